@@ -1,20 +1,20 @@
+import os
 from flask import Flask
-from config import Development
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_login import LoginManager
-from markdown import Markdown
+from app.database import engine_options, RoutingSession
 
 
 app = Flask(__name__)
-app.config.from_object(Development)
-db = SQLAlchemy(app)
+app.config.from_object('config.' + (os.environ.get('APP_CONFIG') or 'Development'))
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config)
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
 migrate = Migrate(app, db=db)
 login = LoginManager(app)
 login.login_view = 'login'
-markdown = Markdown()
 
 
 
 
-from app import routes, models
\ No newline at end of file
+from app import routes, models, identity, profiler, fragments, avatars, replicas, taxonomy, reference, generations
\ No newline at end of file
@@ -0,0 +1,101 @@
+import os
+import re
+import tempfile
+from hashlib import md5
+import sqlalchemy as sa
+from flask import abort, request, send_from_directory
+from app import app, db
+
+
+#Avatar URLs
+#The md5 of the address is stored on the user (User.email_hash), so building
+#an avatar URL is string formatting only. Sizes are snapped to AVATAR_SIZES,
+#which keeps the number of distinct images (and browser cache entries) small.
+#AVATAR_SOURCE 'gravatar' links to gravatar.com; 'local' serves identicons
+#generated by this app, with a year-long immutable Cache-Control since an
+#image never changes for a given hash. Only the hashes of existing users are
+#kept as files in AVATAR_CACHE_DIR, at most AVATAR_CACHE_FILES of them; any
+#other well-formed hash is rendered in memory, so requests for made-up hashes
+#can't fill the disk.
+GRAVATAR_URL = 'https://www.gravatar.com/avatar/{hash}?d=identicon&s={size}'
+LOCAL_URL = '/avatars/{hash}/{size}.svg'
+HASH_RE = re.compile(r'[0-9a-f]{32}')
+GRID = 5
+
+
+def email_hash(email):
+    return md5(email.strip().lower().encode('utf-8')).hexdigest()
+
+
+def avatar_size(size):
+    #smallest allowed size that is at least the one asked for
+    sizes = app.config['AVATAR_SIZES']
+    return next((allowed for allowed in sizes if allowed >= size), sizes[-1])
+
+
+def avatar_url(hash, size):
+    if app.config['AVATAR_SOURCE'] == 'local':
+        return request.script_root + LOCAL_URL.format(hash=hash, size=avatar_size(size))
+    return GRAVATAR_URL.format(hash=hash, size=avatar_size(size))
+
+
+def identicon_svg(hash, size):
+    #5x5 grid mirrored around the middle column, cells and colour taken from
+    #the hash, as gravatar's and GitHub's identicons do
+    colour = '#' + hash[-6:]
+    cell = size / GRID
+    rects = []
+    for row in range(GRID):
+        for col in range((GRID + 1) // 2):
+            if int(hash[row * 3 + col], 16) % 2:
+                continue
+            for x in {col, GRID - 1 - col}:
+                rects.append(f'<rect x="{x * cell:.2f}" y="{row * cell:.2f}" width="{cell:.2f}" height="{cell:.2f}"/>')
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{size}" height="{size}" viewBox="0 0 {size} {size}">'
+        f'<rect width="{size}" height="{size}" fill="#f0f0f0"/><g fill="{colour}">{"".join(rects)}</g></svg>'
+    )
+
+
+def known_hash(hash):
+    #app.models imports this module for avatar_url()
+    from app.models import User
+    return db.session.scalar(sa.select(User.id).where(User.email_hash == hash).limit(1)) is not None
+
+
+def cached_files(directory):
+    with os.scandir(directory) as entries:
+        return sum(1 for entry in entries if entry.name.endswith('.svg'))
+
+
+def write_avatar(path, hash, size):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    if cached_files(directory) >= app.config['AVATAR_CACHE_FILES']:
+        return False
+    #write then rename, so a concurrent request never serves half a file
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        f.write(identicon_svg(hash, size))
+    os.replace(tmp, path)
+    return True
+
+
+@app.route('/avatars/<hash>/<int:size>.svg')
+def avatar(hash, size):
+    #only whitelisted sizes and well-formed hashes, and files only for users
+    #that exist
+    if app.config['AVATAR_SOURCE'] != 'local' or not HASH_RE.fullmatch(hash) or size not in app.config['AVATAR_SIZES']:
+        abort(404)
+    directory = app.config['AVATAR_CACHE_DIR']
+    name = f'{hash}-{size}.svg'
+    path = os.path.join(directory, name)
+    if os.path.exists(path) or (known_hash(hash) and write_avatar(path, hash, size)):
+        response = send_from_directory(directory, name, mimetype='image/svg+xml',
+                                       max_age=app.config['AVATAR_MAX_AGE'])
+    else:
+        response = app.response_class(identicon_svg(hash, size), mimetype='image/svg+xml')
+        response.cache_control.public = True
+        response.cache_control.max_age = app.config['AVATAR_MAX_AGE']
+    response.cache_control.immutable = True
+    return response
@@ -0,0 +1,193 @@
+import logging
+import sqlite3
+import threading
+import time
+import sqlalchemy as sa
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import QueuePool
+from flask_sqlalchemy.session import Session
+
+
+#Engine profile
+#engine_options(config) turns the config class into create_engine arguments
+#before Flask-SQLAlchemy builds the engine (see app/__init__.py):
+#  - SQLite files get SQLITE_PRAGMAS on every new connection. WAL lets
+#    readers run while a writer commits; busy_timeout makes a second writer
+#    wait for the lock instead of failing with 'database is locked'.
+#  - Server databases keep pool_pre_ping/pool_recycle, which SQLite files
+#    don't need (their connections never go stale).
+#  - Pooled engines use InstrumentedQueuePool, which counts checkouts and
+#    the time spent waiting for a free connection (reported by /health).
+SQLITE_PRAGMAS = {}
+SERVER_ONLY_OPTIONS = ('pool_pre_ping', 'pool_recycle')
+
+
+class PoolStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connects = 0
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+
+    def record_wait(self, elapsed, timed_out=False):
+        with self.lock:
+            self.checkouts += not timed_out
+            self.timeouts += timed_out
+            self.wait_time += elapsed
+            self.max_wait = max(self.max_wait, elapsed)
+
+    def snapshot(self, pool):
+        with self.lock:
+            stats = {
+                'pool': type(pool).__name__,
+                'connects': self.connects,
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'wait_ms_total': round(self.wait_time * 1000, 2),
+                'wait_ms_max': round(self.max_wait * 1000, 2),
+                'wait_ms_avg': round(self.wait_time * 1000 / self.checkouts, 3) if self.checkouts else 0.0,
+            }
+        if isinstance(pool, QueuePool):
+            stats.update(size=pool.size(), checked_in=pool.checkedin(),
+                         checked_out=pool.checkedout(), overflow=pool.overflow())
+        return stats
+
+
+pool_stats = PoolStats()
+
+
+class InstrumentedQueuePool(QueuePool):
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except TimeoutError:
+            pool_stats.record_wait(time.perf_counter() - started, timed_out=True)
+            raise
+        pool_stats.record_wait(time.perf_counter() - started)
+        return connection
+
+
+#pool loggers are named after the class's module; keep this one quiet like
+#sqlalchemy's own instead of inheriting the app logger's DEBUG level
+logging.getLogger(f'{__name__}.{InstrumentedQueuePool.__name__}').setLevel(logging.WARNING)
+
+
+@event.listens_for(InstrumentedQueuePool, 'connect')
+def configure_connection(dbapi_connection, connection_record):
+    with pool_stats.lock:
+        pool_stats.connects += 1
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+        cursor.close()
+
+
+def engine_options(config, uri=None):
+    options = dict(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    url = make_url(uri or config['SQLALCHEMY_DATABASE_URI'])
+    if url.get_backend_name() == 'sqlite':
+        if url.database in (None, '', ':memory:'):
+            #Flask-SQLAlchemy gives in-memory databases a StaticPool, nothing to size
+            return {}
+        SQLITE_PRAGMAS.clear()
+        SQLITE_PRAGMAS.update(config.get('SQLITE_PRAGMAS') or {})
+        for name in SERVER_ONLY_OPTIONS:
+            options.pop(name, None)
+    options.setdefault('poolclass', InstrumentedQueuePool)
+    return options
+
+
+def sqlite_settings(connection):
+    #effective values, as reported by the connection itself
+    return {name: connection.exec_driver_sql(f'PRAGMA {name}').scalar() for name in SQLITE_PRAGMAS}
+
+
+#Read replicas
+#RoutingSession sends a SELECT to a replica when the session allows it
+#(session.info['use_replica'], set per request by app/replicas.py). Flushes and
+#INSERT/UPDATE/DELETE always go to the primary, and after the first one the
+#session stays on the primary, so a request reads its own writes. Raw text()
+#statements can't be told apart and go to the primary too.
+class ReplicaSet:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.engines = []
+        self.down_until = {}
+        self.checked_at = {}
+        self.next = 0
+        self.retry_interval = 30
+
+    def configure(self, engines, retry_interval):
+        #engines: (uri, create_engine options) pairs
+        self.retry_interval = retry_interval
+        for uri, options in engines:
+            engine = sa.create_engine(uri, **options)
+            event.listen(engine, 'handle_error', self.on_error)
+            self.engines.append(engine)
+
+    def choose(self):
+        #round robin over the replicas that haven't failed recently; one that
+        #wasn't checked for retry_interval seconds must accept a connection first
+        for _ in range(len(self.engines)):
+            now = time.monotonic()
+            with self.lock:
+                engine = self.engines[self.next % len(self.engines)]
+                self.next += 1
+                if self.down_until.get(engine, 0) > now:
+                    continue
+                probe = now - self.checked_at.get(engine, float('-inf')) > self.retry_interval
+                if probe:
+                    self.checked_at[engine] = now
+            if not probe or self.probe(engine):
+                return engine
+        return None
+
+    def probe(self, engine):
+        try:
+            engine.connect().close()
+            return True
+        except sa.exc.DBAPIError:
+            self.mark_down(engine)
+            return False
+
+    def mark_down(self, engine):
+        with self.lock:
+            self.down_until[engine] = time.monotonic() + self.retry_interval
+
+    def on_error(self, context):
+        #a replica that can't be reached is skipped for retry_interval seconds
+        if context.is_disconnect or isinstance(context.sqlalchemy_exception, sa.exc.OperationalError):
+            self.mark_down(context.engine)
+
+    def status(self):
+        now = time.monotonic()
+        with self.lock:
+            return [{'url': engine.url.render_as_string(hide_password=True),
+                     'healthy': self.down_until.get(engine, 0) <= now}
+                    for engine in self.engines]
+
+
+replicas = ReplicaSet()
+
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self.info.get('use_replica'):
+            if not self._flushing and getattr(clause, 'is_select', False):
+                #one replica per session, so a page never mixes two replication positions
+                if 'replica' not in self.info:
+                    self.info['replica'] = replicas.choose()
+                if self.info['replica'] is not None:
+                    return self.info['replica']
+            else:
+                #anything that may write pins the rest of the session to the primary
+                self.info['use_replica'] = False
+        if self._flushing or getattr(clause, 'is_dml', False):
+            self.info['wrote'] = True
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
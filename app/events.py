@@ -0,0 +1,173 @@
+import json
+import queue
+import threading
+import time
+from collections import defaultdict
+import sqlalchemy as sa
+from app import app
+from app.models import Notification, User
+
+
+#In-process pub/sub for live notifications (Server-Sent Events)
+#notify_followers publishes every notification after its chunk commits; each
+#open /notifications/stream connection holds a bounded queue and no database
+#connection. Notifications written by another process (a job worker, another
+#web worker) are never published here, so every keepalive tick reads the
+#user's unread counter, one primary key lookup, and catches up from the
+#notifications table when it moved. The table is also read when a client
+#resumes with Last-Event-ID or its queue overflowed.
+#Each stream holds a worker thread: a user gets SSE_STREAMS_PER_USER of them
+#per process (the oldest is closed for a new one, its tab stops listening)
+#and the process SSE_MAX_STREAMS in all.
+CLOSE = object()
+
+
+class Subscriber:
+    def __init__(self, user_id, buffer_size):
+        self.user_id = user_id
+        self.queue = queue.Queue(maxsize=buffer_size)
+        self.overflowed = False
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+        try:
+            self.queue.put_nowait(CLOSE)
+        except queue.Full:
+            #the stream is busy draining and sees the flag on its next pass
+            pass
+
+    def push(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            #the stream resyncs from the database instead of growing without bound
+            self.overflowed = True
+
+
+class Broker:
+    def __init__(self):
+        self.lock = threading.Lock()
+        #per user, oldest first
+        self.subscribers = defaultdict(list)
+        self.count = 0
+
+    def subscribe(self, user_id, buffer_size, max_streams, per_user):
+        with self.lock:
+            subscribers = self.subscribers[user_id]
+            while subscribers and len(subscribers) >= per_user:
+                subscribers.pop(0).close()
+                self.count -= 1
+            if self.count >= max_streams:
+                if not subscribers:
+                    del self.subscribers[user_id]
+                return None
+            subscriber = Subscriber(user_id, buffer_size)
+            subscribers.append(subscriber)
+            self.count += 1
+            return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            subscribers = self.subscribers.get(subscriber.user_id)
+            if subscribers and subscriber in subscribers:
+                subscribers.remove(subscriber)
+                self.count -= 1
+                if not subscribers:
+                    del self.subscribers[subscriber.user_id]
+
+    def publish(self, user_id, event):
+        with self.lock:
+            subscribers = list(self.subscribers.get(user_id, ()))
+        for subscriber in subscribers:
+            subscriber.push(event)
+
+    def listening(self, user_ids):
+        with self.lock:
+            return [user_id for user_id in user_ids if user_id in self.subscribers]
+
+
+broker = Broker()
+
+
+def notification_event(id, message, post_id, timestamp):
+    return {'id': id, 'message': message, 'post_id': post_id, 'timestamp': timestamp.isoformat()}
+
+
+def format_event(event):
+    return f'id: {event["id"]}\nevent: notification\ndata: {json.dumps(event)}\n\n'
+
+
+def missed_events(engine, user_id, after_id, limit):
+    #short-lived connection, released before the stream waits again
+    with engine.connect() as conn:
+        rows = conn.execute(
+            sa.select(Notification.id, Notification.message, Notification.post_id, Notification.timestamp)
+            .where(Notification.user_id == user_id, Notification.id > after_id)
+            .order_by(Notification.id)
+            .limit(limit)
+        ).all()
+    return [notification_event(*row) for row in rows]
+
+
+def unread_count(engine, user_id):
+    with engine.connect() as conn:
+        return conn.execute(sa.select(User.unread_notifications).where(User.id == user_id)).scalar()
+
+
+def latest_event_id(engine, user_id):
+    with engine.connect() as conn:
+        return conn.execute(
+            sa.select(sa.func.coalesce(sa.func.max(Notification.id), 0)).where(Notification.user_id == user_id)
+        ).scalar()
+
+
+def stream(engine, subscriber, last_event_id=None):
+    config = app.config
+    buffer_size = config['SSE_BUFFER_SIZE']
+    try:
+        yield f'retry: {config["SSE_RETRY_MS"]}\n\n'
+
+        unread = unread_count(engine, subscriber.user_id)
+        if last_event_id is None:
+            last_event_id = latest_event_id(engine, subscriber.user_id)
+        else:
+            for event in missed_events(engine, subscriber.user_id, last_event_id, buffer_size):
+                last_event_id = event['id']
+                yield format_event(event)
+
+        #end the stream now and then; the browser reconnects with Last-Event-ID
+        deadline = time.monotonic() + config['SSE_MAX_DURATION']
+        while not subscriber.closed and time.monotonic() < deadline:
+            try:
+                events = [subscriber.queue.get(timeout=config['SSE_KEEPALIVE'])]
+            except queue.Empty:
+                #written elsewhere, or read meanwhile: either way the counter moved
+                current = unread_count(engine, subscriber.user_id)
+                if current == unread and not subscriber.overflowed:
+                    yield ': keepalive\n\n'
+                    continue
+                unread = current
+                subscriber.overflowed = True
+                events = []
+
+            if subscriber.closed:
+                break
+            if subscriber.overflowed:
+                subscriber.overflowed = False
+                while not subscriber.queue.empty():
+                    subscriber.queue.get_nowait()
+                events = missed_events(engine, subscriber.user_id, last_event_id, buffer_size)
+                if not events:
+                    yield ': keepalive\n\n'
+
+            for event in events:
+                if event['id'] > last_event_id:
+                    last_event_id = event['id']
+                    yield format_event(event)
+
+        if subscriber.closed:
+            #replaced by a newer stream of the same user: tell the page not to reconnect
+            yield 'event: close\ndata: {}\n\n'
+    finally:
+        broker.unsubscribe(subscriber)
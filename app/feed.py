@@ -0,0 +1,43 @@
+import sqlalchemy as sa
+from app import app, db
+from app.models import Post, followers
+from app.pagination import keyset_page, keyset_query
+from app.queries import select_post_cards
+from app.timeline import timeline_enabled, timeline_feed
+
+
+#Home feed: posts from the user and everyone they follow
+def feed_authors(user):
+    #followed ids straight from the association table + the user itself,
+    #kept as a subquery so the database does the join instead of Python
+    return sa.union(
+        sa.select(followers.c.followed_id.label('author_id')).where(followers.c.follower_id == user.id),
+        sa.select(sa.literal(user.id).label('author_id'))
+    ).subquery()
+
+
+def feed_floor(authors, cursor, limit):
+    #the limit-th newest post of every author past the cursor, one short range
+    #scan on ix_posts_author_id_create_at each. The page can't reach below the
+    #newest of them: that author alone has limit posts at or above it. None
+    #when nobody has that many, and then there is little to sort anyway.
+    nth = keyset_query(
+        sa.select(Post.create_at).where(Post.author_id == authors.c.author_id),
+        Post.create_at, Post.id, cursor=cursor, limit=1
+    ).offset(limit - 1).scalar_subquery()
+    return db.session.scalar(sa.select(sa.func.max(nth)).select_from(authors))
+
+
+def home_feed(user, cursor=None, per_page=None):
+    per_page = per_page or app.config['POSTS_PER_PAGE']
+    if timeline_enabled():
+        return timeline_feed(user, cursor=cursor, per_page=per_page)
+
+    authors = feed_authors(user)
+    stmt = select_post_cards().join(authors, Post.author_id == authors.c.author_id)
+    #bounding create_at lets each author's index scan stop at the floor
+    #instead of sorting every followed post before the LIMIT
+    floor = feed_floor(authors, cursor, per_page + 1)
+    if floor is not None:
+        stmt = stmt.where(Post.create_at >= floor)
+    return keyset_page(db.session, stmt, Post.create_at, Post.id, cursor=cursor, per_page=per_page)
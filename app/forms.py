@@ -72,4 +72,9 @@ class CategoryForm(FlaskForm):
             )
         )
         if category is not None:
-            raise ValidationError('Category already exist!')
\ No newline at end of file
+            raise ValidationError('Category already exist!')
+
+
+#Button-only POST forms (mark as read, ...): just the CSRF token
+class EmptyForm(FlaskForm):
+    submit = SubmitField('Submit')
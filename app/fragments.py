@@ -0,0 +1,158 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+from werkzeug.utils import import_string
+from app import app
+from app.http_cache import TEMPLATE_FINGERPRINT
+from app.rendering import RenderCache
+
+
+#Rendered-fragment cache
+#Templates opt in with
+#    {% cache 'card', post.id, post.update_at %} ... {% endcache %}
+#The key is the template name and line of the tag, the values given, and the
+#templates fingerprint, so an edited post or a deploy that touches any template
+#never gets an old fragment back. A cached fragment must only depend on the
+#values in its key (no current_user, no request args).
+#FRAGMENT_CACHE picks the store: 'memory' (per worker, bounded by bytes),
+#'sqlite' (one file shared by every worker on the host), the import path of a
+#class with the same interface, or None to render everything.
+class MemoryBackend(RenderCache):
+    name = 'memory'
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config['FRAGMENT_CACHE_BYTES'])
+
+
+class SqliteBackend:
+    #entries are evicted oldest-stored first: refreshing an access time on
+    #every hit would turn each read into a write shared by all workers
+    name = 'sqlite'
+    prune_every = 500
+
+    def __init__(self, path, max_entries):
+        self.path = path
+        self.max_entries = max_entries
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        conn = self.connect()
+        conn.execute('CREATE TABLE IF NOT EXISTS fragments (key TEXT PRIMARY KEY, html TEXT NOT NULL, stored_at REAL NOT NULL)')
+        conn.execute('CREATE INDEX IF NOT EXISTS ix_fragments_stored_at ON fragments (stored_at)')
+        conn.close()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config['FRAGMENT_CACHE_PATH'], config['FRAGMENT_CACHE_ENTRIES'])
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=1, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def connection(self):
+        #one connection per thread, opened lazily so forked workers never share one
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = self.connect()
+        return conn
+
+    def get(self, key):
+        try:
+            row = self.connection().execute('SELECT html FROM fragments WHERE key = ?', (key,)).fetchone()
+        except sqlite3.Error:
+            app.logger.warning('Fragment cache read failed', exc_info=True)
+            row = None
+        with self.lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return row[0]
+
+    def put(self, key, html):
+        try:
+            conn = self.connection()
+            conn.execute('INSERT OR REPLACE INTO fragments (key, html, stored_at) VALUES (?, ?, ?)',
+                         (key, html, time.time()))
+            with self.lock:
+                self.writes += 1
+                prune = self.writes % self.prune_every == 0
+            if prune:
+                conn.execute('DELETE FROM fragments WHERE key IN ('
+                             'SELECT key FROM fragments ORDER BY stored_at DESC LIMIT -1 OFFSET ?)',
+                             (self.max_entries,))
+        except sqlite3.Error:
+            #a busy or broken cache only costs a render
+            app.logger.warning('Fragment cache write failed', exc_info=True)
+
+    def clear(self):
+        self.connection().execute('DELETE FROM fragments')
+
+    def stats(self):
+        with self.lock:
+            hits, misses = self.hits, self.misses
+        lookups = hits + misses
+        return {
+            'entries': self.connection().execute('SELECT count(*) FROM fragments').fetchone()[0],
+            'max_entries': self.max_entries,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / lookups if lookups else 0.0,
+        }
+
+
+BACKENDS = {'memory': MemoryBackend, 'sqlite': SqliteBackend}
+_cache = {}
+
+
+def get_fragment_cache():
+    if 'instance' not in _cache:
+        name = app.config['FRAGMENT_CACHE']
+        cls = (BACKENDS.get(name) or import_string(name)) if name else None
+        _cache['instance'] = cls.from_config(app.config) if cls else None
+    return _cache['instance']
+
+
+def fragment_stats():
+    cache = get_fragment_cache()
+    return cache.stats() if cache is not None else None
+
+
+def fragment_key(parts):
+    return hashlib.sha1(repr((TEMPLATE_FINGERPRINT, parts)).encode('utf-8')).hexdigest()
+
+
+class FragmentCacheExtension(Extension):
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        parts = [nodes.Const(f'{parser.name}:{lineno}'), parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            parts.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        call = self.call_method('_cache', [nodes.List(parts)])
+        return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    def _cache(self, parts, caller):
+        cache = get_fragment_cache()
+        if cache is None:
+            return caller()
+        key = fragment_key(parts)
+        html = cache.get(key)
+        if html is None:
+            html = str(caller())
+            cache.put(key, html)
+        return Markup(html)
+
+
+app.jinja_env.add_extension(FragmentCacheExtension)
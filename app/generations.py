@@ -0,0 +1,61 @@
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+from sqlalchemy import event
+from app import db
+from app.models import CacheGeneration, Post
+
+
+#Cache generations
+#One counter per kind of cached data in cache_generations, bumped with a
+#relative UPDATE in the transaction that changes the data, so a reader
+#compares one number instead of scanning the rows. 'reference' belongs to
+#app/reference.py. 'posts' moves with every post created, edited or deleted:
+#through the ORM by the flush hook below, once per transaction; Core writers
+#(flask import, backfill_post_fields, the benchmark data) call
+#bump_posts_generation() themselves. The archive's ETag is built on it, and
+#the in-process search index reloads when it moves.
+POSTS = 'posts'
+
+
+def read_generation(name, conn=None):
+    conn = conn or db.session
+    return conn.scalar(sa.select(CacheGeneration.generation).where(CacheGeneration.name == name)) or 0
+
+
+def increment_generation(name, session=None):
+    #relative UPDATE, in the caller's transaction
+    session = session or db.session
+    session.connection().execute(
+        sa.update(CacheGeneration).where(CacheGeneration.name == name)
+        .values(generation=CacheGeneration.generation + 1)
+    )
+
+
+def posts_generation():
+    return read_generation(POSTS)
+
+
+def bump_posts_generation(session=None):
+    session = session or db.session
+    increment_generation(POSTS, session)
+    session.info['posts_changed'] = True
+
+
+@event.listens_for(so.Session, 'after_flush')
+def track_post_changes(session, flush_context):
+    if session.info.get('posts_changed'):
+        return
+    for obj in session.new | session.dirty | session.deleted:
+        if isinstance(obj, Post) and (obj in session.new or obj in session.deleted or session.is_modified(obj)):
+            bump_posts_generation(session)
+            return
+
+
+@event.listens_for(so.Session, 'after_commit')
+def forget_post_changes(session):
+    session.info.pop('posts_changed', None)
+
+
+@event.listens_for(so.Session, 'after_rollback')
+def discard_post_changes(session):
+    session.info.pop('posts_changed', None)
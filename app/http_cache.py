@@ -0,0 +1,87 @@
+import hashlib
+import os
+from functools import wraps
+from flask import g, request
+from flask_login import current_user
+from werkzeug.http import is_resource_modified
+from app import app
+
+
+#Conditional GETs for read-mostly pages
+#A page's validators (update_at, counters, ...) are read with a cheap query
+#before anything is rendered and hashed into a strong ETag, together with who
+#is looking (the navbar shows the user's name, unread count and admin link)
+#and the templates the page is built from. When the client already holds that
+#version the view is skipped and a bodyless 304 goes out.
+#Every page using this sits behind login_required, so responses are
+#'private, no-cache' with Vary: Cookie: a shared cache never stores them and
+#the browser revalidates on every view, which costs one validator query
+#instead of a render. There is no public variant for a reverse proxy to
+#serve; that would take pages readable without logging in.
+def template_fingerprint():
+    #changes on any deploy that changes a template, so stale ETags can't match
+    digest = hashlib.sha1()
+    for root, dirs, files in sorted(os.walk(app.jinja_loader.searchpath[0])):
+        dirs.sort()
+        for name in sorted(files):
+            with open(os.path.join(root, name), 'rb') as f:
+                digest.update(name.encode() + f.read())
+    return digest.hexdigest()
+
+
+TEMPLATE_FINGERPRINT = template_fingerprint()
+
+
+def viewer_key():
+    if not current_user.is_authenticated:
+        return None
+    return (current_user.id, current_user.unread_notifications, tuple(sorted(current_user.roles)))
+
+
+def make_etag(validators):
+    data = repr((TEMPLATE_FINGERPRINT, request.endpoint, viewer_key(), validators))
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+def check(validators, last_modified=None):
+    #returns a 304 response if the client's copy is current, otherwise None;
+    #either way the validators are kept for the headers of the final response
+    g.http_cache = (make_etag(validators), last_modified)
+    if request.method not in ('GET', 'HEAD'):
+        return None
+    #Last-Modified only dates the resource, not the viewer's navbar, so
+    #If-Modified-Since alone is not enough to answer 304
+    if is_resource_modified(request.environ, etag=g.http_cache[0]):
+        return None
+    return app.response_class(status=304)
+
+
+def conditional(validators=None):
+    #validators(**view_args) -> (validators, last_modified), or None to let the
+    #view answer on its own (a 404, say). Views that need their own data to
+    #build the validators leave it out and call check() themselves.
+    def decorator(func):
+        @wraps(func)
+        def decorated_view(*args, **kwargs):
+            response = None
+            if validators is not None:
+                result = validators(*args, **kwargs)
+                if result is not None:
+                    response = check(*result)
+            if response is None:
+                response = app.make_response(func(*args, **kwargs))
+            if response.status_code in (200, 304) and 'http_cache' in g:
+                add_cache_headers(response)
+            return response
+        return decorated_view
+    return decorator
+
+
+def add_cache_headers(response):
+    etag, last_modified = g.http_cache
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
@@ -0,0 +1,132 @@
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from flask import g
+from flask_login import UserMixin
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+from sqlalchemy import event
+from app import app, db, login
+from app.models import User, Role, user_roles
+from app.replicas import use_primary
+
+
+#Cached current_user
+#Flask-Login gets an Identity: a plain snapshot of the user row plus a
+#frozenset of role names, kept per worker in an LRU with a TTL. has_role and
+#the navbar need no query at all, follow checks only need the id; anything
+#else (follow, followed, ...) is forwarded to the real User, loaded once per
+#request on first use.
+#Writes that change a snapshot call invalidate_on_commit(user_id); the entry
+#is dropped after the commit, and the version stamp keeps a load that raced
+#with the invalidation from being cached. Other workers pick the change up
+#within USER_CACHE_TTL seconds.
+class Identity(UserMixin):
+    def __init__(self, id, username, email, email_hash, unread_notifications, roles):
+        self.id = id
+        self.username = username
+        self.email = email
+        self.email_hash = email_hash
+        self.unread_notifications = unread_notifications
+        self.roles = roles
+        self.loaded_at = time.monotonic()
+
+    def has_role(self, role_name):
+        return role_name in self.roles
+
+    def avatar(self, size):
+        return User.avatar(self, size)
+
+    def is_following(self, user):
+        return User.is_following(self, user)
+
+    def is_following_many(self, user_ids):
+        return User.is_following_many(self, user_ids)
+
+    @property
+    def user(self):
+        #the ORM object, for relationship work; never stored on the cached snapshot
+        users = g.setdefault('identity_users', {})
+        if self.id not in users:
+            users[self.id] = db.session.get(User, self.id)
+        return users[self.id]
+
+    def __getattr__(self, name):
+        return getattr(self.user, name)
+
+    def __eq__(self, other):
+        if isinstance(other, (User, Identity)):
+            return other.id == self.id
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.id)
+
+
+def load_identity(user_id):
+    row = db.session.execute(
+        sa.select(User.id, User.username, User.email, User.email_hash, User.unread_notifications).where(User.id == user_id)
+    ).first()
+    if row is None:
+        return None
+    roles = db.session.scalars(
+        sa.select(Role.name).join(user_roles, user_roles.c.role_id == Role.id).where(user_roles.c.user_id == user_id)
+    ).all()
+    return Identity(*row, roles=frozenset(roles))
+
+
+class IdentityCache:
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.versions = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def get(self, user_id):
+        with self.lock:
+            identity = self.entries.get(user_id)
+            if identity is not None and time.monotonic() - identity.loaded_at < self.ttl:
+                self.entries.move_to_end(user_id)
+                return identity
+            version = self.versions[user_id]
+
+        #from the primary: a lagging replica would put stale roles back in the cache
+        with use_primary():
+            identity = load_identity(user_id)
+
+        with self.lock:
+            if identity is not None and self.versions[user_id] == version:
+                self.entries[user_id] = identity
+                self.entries.move_to_end(user_id)
+                while len(self.entries) > self.max_size:
+                    self.entries.popitem(last=False)
+        return identity
+
+    def invalidate(self, user_id):
+        with self.lock:
+            self.versions[user_id] += 1
+            self.entries.pop(user_id, None)
+
+
+identity_cache = IdentityCache(app.config['USER_CACHE_SIZE'], app.config['USER_CACHE_TTL'])
+
+
+def invalidate_on_commit(*user_ids):
+    db.session.info.setdefault('identities_to_invalidate', set()).update(user_ids)
+
+
+@event.listens_for(so.Session, 'after_commit')
+def invalidate_committed_identities(session):
+    for user_id in session.info.pop('identities_to_invalidate', ()):
+        identity_cache.invalidate(user_id)
+
+
+@event.listens_for(so.Session, 'after_rollback')
+def forget_rolled_back_identities(session):
+    session.info.pop('identities_to_invalidate', None)
+
+
+@login.user_loader
+def load_user(id):
+    return identity_cache.get(int(id))
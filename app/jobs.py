@@ -0,0 +1,190 @@
+import json
+import random
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+from sqlalchemy import event
+from app import app, db
+from app.models import Job
+from app.services import insert_ignore
+
+
+#Background jobs
+#A job is a row in the jobs table, inserted in the caller's transaction, so
+#it exists if and only if the work that triggered it was committed. Rows are
+#claimed with a single UPDATE, run, and either marked done or requeued with
+#exponential backoff until max_attempts. An idempotency key makes enqueueing
+#the same work twice a no-op.
+#
+#JOBS_MODE:
+#  'queue'  - rows are picked up by `flask run-worker` (a process pool)
+#  'thread' - like 'queue', but this process also runs the job on a local
+#             thread pool right after commit; failed attempts wait for a worker
+#  'eager'  - run inline, nothing is stored (tests)
+TASKS = {}
+
+
+def task(func):
+    TASKS[func.__name__] = func
+    return func
+
+
+def utcnow():
+    return datetime.now(timezone.utc)
+
+
+def enqueue(func, idempotency_key=None, delay=0, max_attempts=None, **kwargs):
+    if app.config['JOBS_MODE'] == 'eager':
+        return func(**kwargs)
+
+    stmt = insert_ignore(Job).values(
+        name=func.__name__,
+        args=json.dumps(kwargs),
+        status='queued',
+        attempts=0,
+        max_attempts=max_attempts or app.config['JOB_MAX_ATTEMPTS'],
+        run_at=utcnow() + timedelta(seconds=delay),
+        idempotency_key=idempotency_key,
+        create_at=utcnow(),
+    ).returning(Job.id)
+    job_id = db.session.execute(stmt).scalar()
+    if job_id is not None and app.config['JOBS_MODE'] == 'thread' and not delay:
+        db.session.info.setdefault('jobs_to_start', []).append(job_id)
+    return job_id
+
+
+@event.listens_for(so.Session, 'after_commit')
+def start_committed_jobs(session):
+    for job_id in session.info.pop('jobs_to_start', []):
+        local_executor().submit(run_in_thread, job_id)
+
+
+@event.listens_for(so.Session, 'after_rollback')
+def forget_rolled_back_jobs(session):
+    session.info.pop('jobs_to_start', None)
+
+
+def claim(limit, job_id=None):
+    #single UPDATE so two workers can't take the same row; the status check in
+    #the outer WHERE is re-evaluated by databases that wait on the row lock
+    now = utcnow()
+    ready = (
+        sa.select(Job.id)
+        .where(Job.status == 'queued', Job.run_at <= now)
+        .order_by(Job.run_at, Job.id)
+        .limit(limit)
+    )
+    if job_id is not None:
+        ready = ready.where(Job.id == job_id)
+    rows = db.session.execute(
+        sa.update(Job)
+        .where(Job.id.in_(ready), Job.status == 'queued')
+        .values(status='running', locked_at=now, attempts=Job.attempts + 1)
+        .returning(Job.id, Job.name, Job.args, Job.attempts, Job.max_attempts)
+    ).all()
+    db.session.commit()
+    return rows
+
+
+def backoff(attempts):
+    delay = app.config['JOB_BACKOFF_BASE'] * 2 ** (attempts - 1)
+    return min(delay, app.config['JOB_BACKOFF_MAX']) * random.uniform(0.8, 1.2)
+
+
+def finish(job, error=None):
+    values = {'locked_at': None, 'last_error': error}
+    if error is None:
+        values.update(status='done', finished_at=utcnow())
+    elif job.attempts < job.max_attempts:
+        values.update(status='queued', run_at=utcnow() + timedelta(seconds=backoff(job.attempts)))
+    else:
+        values.update(status='failed', finished_at=utcnow())
+        app.logger.error('Job %s (%s) failed after %s attempts', job.id, job.name, job.attempts)
+    db.session.execute(sa.update(Job).where(Job.id == job.id).values(**values))
+    db.session.commit()
+
+
+def requeue_stale():
+    #jobs left 'running' by a worker that died
+    cutoff = utcnow() - timedelta(seconds=app.config['JOB_TIMEOUT'])
+    result = db.session.execute(
+        sa.update(Job)
+        .where(Job.status == 'running', Job.locked_at < cutoff)
+        .values(status='queued', locked_at=None, run_at=utcnow())
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def execute(name, args):
+    #runs in the worker process/thread; returns None or the formatted error
+    with app.app_context():
+        try:
+            TASKS[name](**json.loads(args))
+            return None
+        except Exception:
+            db.session.rollback()
+            return traceback.format_exc()
+
+
+_local = {}
+
+
+def local_executor():
+    if 'executor' not in _local:
+        _local['executor'] = ThreadPoolExecutor(max_workers=app.config['JOB_WORKERS'], thread_name_prefix='jobs')
+    return _local['executor']
+
+
+def run_in_thread(job_id):
+    with app.app_context():
+        for job in claim(1, job_id=job_id):
+            finish(job, execute(job.name, job.args))
+
+
+def init_worker_process():
+    #connections inherited from the parent must not be reused after fork
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+
+def run_worker(concurrency=None, poll_interval=None, once=False):
+    concurrency = concurrency or app.config['JOB_WORKERS']
+    poll_interval = poll_interval or app.config['JOB_POLL_INTERVAL']
+    processed = 0
+    with ProcessPoolExecutor(max_workers=concurrency, initializer=init_worker_process) as pool:
+        running = {}
+        last_stale_check = 0.0
+        while True:
+            if time.monotonic() - last_stale_check > app.config['JOB_TIMEOUT']:
+                requeue_stale()
+                last_stale_check = time.monotonic()
+
+            free = concurrency - len(running)
+            if free:
+                for job in claim(free):
+                    running[pool.submit(execute, job.name, job.args)] = job
+
+            if not running:
+                if once:
+                    return processed
+                time.sleep(poll_interval)
+                continue
+
+            done, _ = wait(running, timeout=poll_interval, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = running.pop(future)
+                try:
+                    error = future.result()
+                except Exception:
+                    error = traceback.format_exc()
+                finish(job, error)
+                processed += 1
+
+
+def job_stats():
+    counts = dict(db.session.execute(sa.select(Job.status, sa.func.count()).group_by(Job.status)).all())
+    return {status: counts.get(status, 0) for status in ('queued', 'running', 'done', 'failed')}
@@ -1,20 +1,27 @@
 from typing import Optional, List
 import  sqlalchemy as sa 
 import sqlalchemy.orm as so
-from app import db, login
+from app import db
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
 from datetime import datetime, timezone
 from slugify import slugify
 from sqlalchemy import event
-from hashlib import md5
+import math
+from app.rendering import render_markdown
+from app.avatars import avatar_url, email_hash
 
 
 post_tags = sa.Table(
     'post_tags',
     db.Model.metadata,
     sa.Column('post_id', sa.Integer, sa.ForeignKey('posts.id'), primary_key=True),
-    sa.Column('tag_id', sa.Integer, sa.ForeignKey('tags.id'), primary_key=True)
+    sa.Column('tag_id', sa.Integer, sa.ForeignKey('tags.id'), primary_key=True),
+    #copy of posts.create_at, stamped after the flush (see app/taxonomy.py)
+    sa.Column('create_at', sa.DateTime),
+    #the primary key serves "tags of a post"; this one serves tag pages in
+    #the archive's (create_at, id) order, as a range scan
+    sa.Index('ix_post_tags_tag_id_create_at', 'tag_id', 'create_at', 'post_id')
 )
 
 user_roles = sa.Table(
@@ -28,7 +35,10 @@ followers = sa.Table(
     'followers',
     db.Model.metadata,
     sa.Column('follower_id', sa.Integer, sa.ForeignKey('users.id'), primary_key=True),
-    sa.Column('followed_id', sa.Integer, sa.ForeignKey('users.id'), primary_key=True)
+    sa.Column('followed_id', sa.Integer, sa.ForeignKey('users.id'), primary_key=True),
+    #the primary key only serves "who does X follow"; this one serves
+    #"who follows X" (fan-out, notifications) without touching the table
+    sa.Index('ix_followers_followed_id_follower_id', 'followed_id', 'follower_id')
 )
 
 #User models
@@ -38,10 +48,19 @@ class User(UserMixin, db.Model):
     id: so.Mapped[int] = so.mapped_column(primary_key=True)
     username: so.Mapped[str] = so.mapped_column(sa.String(64), index=True, unique=True)
     email: so.Mapped[str] = so.mapped_column(sa.String(150), index=True, unique=True)
+    #md5 of the normalized email, set whenever email is (see app/avatars.py)
+    email_hash: so.Mapped[Optional[str]] = so.mapped_column(sa.String(32), index=True)
     password_hash: so.Mapped[str] = so.mapped_column(sa.String(256))
     
     bio: so.Mapped[Optional[str]] = so.mapped_column(sa.Text)
     
+    #denormalized count of unread notifications, updated in the same
+    #transaction as the notifications themselves (see app/notifications.py)
+    unread_notifications: so.Mapped[int] = so.mapped_column(sa.Integer, default=0, server_default='0')
+    #denormalized, kept in step by follow/unfollow (see `flask recount_follows`)
+    followers_count: so.Mapped[int] = so.mapped_column(sa.Integer, default=0, server_default='0')
+    following_count: so.Mapped[int] = so.mapped_column(sa.Integer, default=0, server_default='0')
+    
     roles: so.Mapped[List['Role']] = so.relationship('Role',
                                                      secondary=user_roles,
                                                      back_populates='users')
@@ -63,8 +82,7 @@ class User(UserMixin, db.Model):
     
     
     def avatar(self, size):
-        digest = md5(self.email.lower().encode('utf-8')).hexdigest()
-        return f"https://www.gravatar.com/avatar/{digest}?d=identicon&s={size}"
+        return avatar_url(self.email_hash or email_hash(self.email), size)
     
     def set_password(self, password):
         self.password_hash = generate_password_hash(password=password)
@@ -84,33 +102,97 @@ class User(UserMixin, db.Model):
             self.roles.remove(role)
             
     #helper methods [follow, followed]
+    #the followers row and both counters change in the same transaction; the
+    #counters only move when a row was really inserted or deleted
     def follow(self, user):
-        if not self.is_following(user):
-            self.followed.append(user)
+        from app.services import insert_ignore
+        inserted = db.session.execute(
+            insert_ignore(followers).values(follower_id=self.id, followed_id=user.id)
+        ).rowcount
+        if inserted:
+            self._add_follow_counts(user, 1)
+        return bool(inserted)
     
     def unfollow(self, user):
-        if self.is_following(user):
-            self.followed.remove(user)
+        deleted = db.session.execute(
+            sa.delete(followers).where(followers.c.follower_id == self.id, followers.c.followed_id == user.id)
+        ).rowcount
+        if deleted:
+            self._add_follow_counts(user, -1)
+        return bool(deleted)
+    
+    def _add_follow_counts(self, user, delta):
+        #relative UPDATEs, so concurrent follows don't overwrite each other
+        db.session.execute(
+            sa.update(User).where(User.id == self.id).values(following_count=User.following_count + delta)
+        )
+        db.session.execute(
+            sa.update(User).where(User.id == user.id).values(followers_count=User.followers_count + delta)
+        )
     
     def is_following(self, user):
-        return self.followed.filter_by(id=user.id).first() is not None
-    
-    def followers_count(self):
-        return len(self.followers)
+        #primary key lookup
+        return db.session.scalar(
+            sa.select(sa.exists().where(followers.c.follower_id == self.id, followers.c.followed_id == user.id))
+        )
+    
+    def is_following_many(self, user_ids):
+        #set of the given ids this user follows, one query for a whole list view
+        user_ids = list(user_ids)
+        if not user_ids:
+            return set()
+        return set(db.session.scalars(
+            sa.select(followers.c.followed_id)
+            .where(followers.c.follower_id == self.id, followers.c.followed_id.in_(user_ids))
+        ))
+
+
+@event.listens_for(User.email, 'set')
+def update_email_hash(target, value, oldvalue, initiator):
+    target.email_hash = email_hash(value) if value else None
 
 
 #post Models  
+EXCERPT_LENGTH = 150
+WORDS_PER_MINUTE = 200
+
+
+def make_excerpt(body):
+    if len(body) > EXCERPT_LENGTH:
+        return body[:EXCERPT_LENGTH] + '...'
+    return body
+
+
 class Post(db.Model):
     __tablename__ = 'posts'
+    __table_args__ = (
+        #home feed: range scan per followed author, newest first
+        sa.Index('ix_posts_author_id_create_at', 'author_id', 'create_at'),
+        #category pages, same order as the archive
+        sa.Index('ix_posts_category_id_create_at', 'category_id', 'create_at'),
+        #archive and export keyset pages: (create_at, id) order without a sort
+        sa.Index('ix_posts_create_at_id', 'create_at', 'id'),
+        #hybrid feed: the few posts left out of the timelines, per author
+        sa.Index('ix_posts_fan_in_author_id_create_at', 'author_id', 'create_at',
+                 sqlite_where=sa.text('fanned_out = 0'), postgresql_where=sa.text('NOT fanned_out')),
+    )
     
     id: so.Mapped[int] = so.mapped_column(primary_key=True)
-    title: so.Mapped[str] = so.mapped_column(sa.String(255), nullable=False)
+    #old title kept in the history even if unloaded, see generate_slug_before_update
+    title: so.Mapped[str] = so.mapped_column(sa.String(255), nullable=False, active_history=True)
     slug: so.Mapped[str] = so.mapped_column(sa.String(255), unique=True, nullable=False)
     body: so.Mapped[str] = so.mapped_column(sa.Text, nullable=False)
+    #derived from body on write, see Post.refresh_body_fields
+    excerpt: so.Mapped[str] = so.mapped_column(sa.String(EXCERPT_LENGTH + 3), nullable=False)
+    body_html: so.Mapped[Optional[str]] = so.mapped_column(sa.Text, deferred=True)
+    word_count: so.Mapped[int] = so.mapped_column(sa.Integer, default=0, server_default='0')
+    reading_time: so.Mapped[int] = so.mapped_column(sa.Integer, default=0, server_default='0')
     create_at: so.Mapped[datetime] = so.mapped_column(sa.DateTime, default=lambda: datetime.now(timezone.utc))
     update_at: so.Mapped[datetime] = so.mapped_column(sa.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
     published_at: so.Mapped[Optional[datetime]] = so.mapped_column(sa.DateTime)
     is_published: so.Mapped[bool] = so.mapped_column(sa.Boolean, default=False)
+    #False when the post skipped fan-out on write (hybrid feed), see app/timeline.py
+    fanned_out: so.Mapped[bool] = so.mapped_column(sa.Boolean, default=True, server_default='1')
     
     author_id: so.Mapped[int] = so.mapped_column(sa.Integer, sa.ForeignKey('users.id'), nullable=False)
     
@@ -122,19 +204,80 @@ class Post(db.Model):
     tags: so.Mapped[List['Tag']] = so.relationship('Tag', secondary=post_tags, back_populates='posts')
     
     notifications: so.Mapped[List['Notification']] = so.relationship('Notification', back_populates='post')
+    
+    #old slugs, redirected to the current one by read_post
+    old_slugs: so.Mapped[List['SlugHistory']] = so.relationship('SlugHistory', cascade='all, delete-orphan')
+    
+    def refresh_body_fields(self):
+        self.excerpt = make_excerpt(self.body)
+        self.body_html = render_markdown(self.body)
+        self.word_count = len(self.body.split())
+        self.reading_time = max(1, math.ceil(self.word_count / WORDS_PER_MINUTE))
+
+
+#room for the -N suffix the allocator may add
+SLUG_BASE_LENGTH = 240
+
+
+def make_slug(title):
+    #shared with the bulk importer (app/transfer.py), which bypasses the listeners
+    return slugify(title, max_length=SLUG_BASE_LENGTH)
 
 
 #Automatically generate slug before saving
+#Slugs come from the slug_counters allocator (app/services.py) and are never
+#handed out twice. A post only gets a new one when its title changes to
+#something that slugifies differently; the old slug goes to slug_history.
 @event.listens_for(Post, 'before_insert')
 def generate_slug_before_insert(mapper, connection, target):
-    if not target.slug:
-        target.slug = slugify(target.title)
+    from app.services import allocate_slug, reserve_slug
+    if target.slug:
+        reserve_slug(connection, target.slug)
+    else:
+        target.slug = allocate_slug(connection, make_slug(target.title))
         
         
 @event.listens_for(Post, 'before_update')
-def generate_slug_before_insert(mapper, connection, target):
-    if target.title:
-        target.slug = slugify(target.title)
+def generate_slug_before_update(mapper, connection, target):
+    from app.services import allocate_slug
+    history = sa.inspect(target).attrs.title.history
+    if not history.has_changes() or not history.deleted:
+        return
+    base = make_slug(target.title)
+    if base == make_slug(history.deleted[0]):
+        return
+    connection.execute(sa.insert(SlugHistory).values(slug=target.slug, post_id=target.id))
+    target.slug = allocate_slug(connection, base)
+
+
+#Excerpt, html and counts are computed once per body change, never on read
+@event.listens_for(Post, 'before_insert')
+def generate_body_fields_before_insert(mapper, connection, target):
+    target.refresh_body_fields()
+
+
+@event.listens_for(Post, 'before_update')
+def generate_body_fields_before_update(mapper, connection, target):
+    if sa.inspect(target).attrs.body.history.has_changes():
+        target.refresh_body_fields()
+
+#Every slug ever handed out, with the last suffix used for it as a base
+#('my-post' -> last 3 means my-post, my-post-2 and my-post-3 were allocated)
+class SlugCounter(db.Model):
+    __tablename__ = 'slug_counters'
+    
+    base: so.Mapped[str] = so.mapped_column(sa.String(255), primary_key=True)
+    last: so.Mapped[int] = so.mapped_column(sa.Integer, default=1)
+
+
+class SlugHistory(db.Model):
+    __tablename__ = 'slug_history'
+    
+    #primary key: read_post's fallback lookup
+    slug: so.Mapped[str] = so.mapped_column(sa.String(255), primary_key=True)
+    post_id: so.Mapped[int] = so.mapped_column(sa.Integer, sa.ForeignKey('posts.id'), index=True)
+    create_at: so.Mapped[datetime] = so.mapped_column(sa.DateTime, default=lambda: datetime.now(timezone.utc))
+
 
 #category models
 class Category(db.Model):
@@ -143,15 +286,23 @@ class Category(db.Model):
     id: so.Mapped[int] = so.mapped_column(sa.Integer, primary_key=True)
     name: so.Mapped[str] = so.mapped_column(sa.String(100), nullable=False, unique=True)
     description: so.Mapped[Optional[str]] = so.mapped_column(sa.Text)
+    #denormalized, kept in step on flush (see app/taxonomy.py)
+    post_count: so.Mapped[int] = so.mapped_column(sa.Integer, default=0, server_default='0')
     
     #Relacion de muchos a muchos
     posts: so.Mapped[List['Post']] = so.relationship('Post', backref='category', lazy=True)
     
 class Tag(db.Model):
     __tablename__ = 'tags'
+    __table_args__ = (
+        #case-insensitive prefix suggestions, see app/taxonomy.py
+        sa.Index('ix_tags_name_lower', sa.func.lower(sa.column('name'))),
+    )
     
     id: so.Mapped[int] = so.mapped_column(sa.Integer, primary_key=True)
     name: so.Mapped[str] = so.mapped_column(sa.String(100), nullable=False, unique=True)
+    #denormalized, kept in step on flush (see app/taxonomy.py)
+    post_count: so.Mapped[int] = so.mapped_column(sa.Integer, default=0, server_default='0')
     
     posts: so.Mapped[List['Post']] = so.relationship('Post', secondary=post_tags, back_populates='tags')
 
@@ -168,6 +319,13 @@ class Role(db.Model):
     
 class Notification(db.Model):
     __tablename__ = 'notifications'
+    __table_args__ = (
+        #inbox pages and the unread filter
+        sa.Index('ix_notifications_user_id_timestamp', 'user_id', 'timestamp'),
+        sa.Index('ix_notifications_user_id_is_read_timestamp', 'user_id', 'is_read', 'timestamp'),
+        #one notification per follower and post, so a retried fan-out job can't send it twice
+        sa.Index('ix_notifications_user_id_post_id', 'user_id', 'post_id', unique=True),
+    )
     
     id: so.Mapped[int] = so.mapped_column(sa.Integer, primary_key=True)
     user_id: so.Mapped[int] = so.mapped_column(sa.Integer, sa.ForeignKey('users.id'))
@@ -181,6 +339,53 @@ class Notification(db.Model):
 
 
 
-@login.user_loader
-def load_user(id):
-    return db.session.get(User, int(id))
\ No newline at end of file
+#Materialized home timeline: one row per (reader, post), written on publish
+class TimelineEntry(db.Model):
+    __tablename__ = 'timeline_entries'
+    __table_args__ = (
+        sa.Index('ix_timeline_entries_user_id_create_at', 'user_id', 'create_at', 'post_id'),
+    )
+    
+    user_id: so.Mapped[int] = so.mapped_column(sa.Integer, sa.ForeignKey('users.id'), primary_key=True)
+    post_id: so.Mapped[int] = so.mapped_column(sa.Integer, sa.ForeignKey('posts.id'), primary_key=True)
+    create_at: so.Mapped[datetime] = so.mapped_column(sa.DateTime)
+
+
+#Shared version numbers of in-process caches, bumped in the transaction that
+#changes the cached rows (see app/reference.py)
+class CacheGeneration(db.Model):
+    __tablename__ = 'cache_generations'
+    
+    name: so.Mapped[str] = so.mapped_column(sa.String(50), primary_key=True)
+    generation: so.Mapped[int] = so.mapped_column(sa.Integer, default=0)
+
+
+#Running totals shared by every process (web, workers), moved with relative
+#UPDATEs (see app/notifications.py)
+class StatCounter(db.Model):
+    __tablename__ = 'stat_counters'
+    
+    name: so.Mapped[str] = so.mapped_column(sa.String(50), primary_key=True)
+    value: so.Mapped[float] = so.mapped_column(sa.Float, default=0)
+
+
+#Durable background job queue, see app/jobs.py
+class Job(db.Model):
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        sa.Index('ix_jobs_status_run_at', 'status', 'run_at'),
+    )
+    
+    id: so.Mapped[int] = so.mapped_column(sa.Integer, primary_key=True)
+    name: so.Mapped[str] = so.mapped_column(sa.String(100))
+    args: so.Mapped[str] = so.mapped_column(sa.Text, default='{}')
+    #queued -> running -> done | failed (back to queued while attempts remain)
+    status: so.Mapped[str] = so.mapped_column(sa.String(20), default='queued')
+    attempts: so.Mapped[int] = so.mapped_column(sa.Integer, default=0)
+    max_attempts: so.Mapped[int] = so.mapped_column(sa.Integer, default=5)
+    run_at: so.Mapped[datetime] = so.mapped_column(sa.DateTime, default=lambda: datetime.now(timezone.utc))
+    locked_at: so.Mapped[Optional[datetime]] = so.mapped_column(sa.DateTime)
+    idempotency_key: so.Mapped[Optional[str]] = so.mapped_column(sa.String(255), unique=True)
+    last_error: so.Mapped[Optional[str]] = so.mapped_column(sa.Text)
+    create_at: so.Mapped[datetime] = so.mapped_column(sa.DateTime, default=lambda: datetime.now(timezone.utc))
+    finished_at: so.Mapped[Optional[datetime]] = so.mapped_column(sa.DateTime)
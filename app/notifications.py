@@ -0,0 +1,130 @@
+import time
+from datetime import datetime, timezone
+import sqlalchemy as sa
+from app import app, db
+from app.models import Notification, Post, StatCounter, User, followers
+from app.jobs import task
+from app.pagination import keyset_page
+from app.events import broker, notification_event
+from app.identity import invalidate_on_commit
+from app.services import insert_ignore
+
+
+#Follower notifications for new posts
+#The follower ids are read in keyset chunks straight from the followers table
+#and each chunk becomes one multi-row INSERT, committed on its own, so a
+#popular author costs len(followers) / NOTIFICATION_CHUNK_SIZE round trips.
+#A retried job starts over from the first follower: the unique (user_id,
+#post_id) index makes the chunks it already committed no-ops, and only the
+#rows really inserted move the unread counters or get published.
+#The totals for the dashboard are rows in stat_counters, so the web process
+#sees the work its workers did.
+FAN_OUT_STATS = ('jobs', 'notifications', 'batches', 'seconds')
+
+
+def follower_ids(user_id, chunk_size):
+    last_id = 0
+    while True:
+        ids = db.session.scalars(
+            sa.select(followers.c.follower_id)
+            .where(followers.c.followed_id == user_id, followers.c.follower_id > last_id)
+            .order_by(followers.c.follower_id)
+            .limit(chunk_size)
+        ).all()
+        if not ids:
+            return
+        yield ids
+        last_id = ids[-1]
+
+
+@task
+def notify_followers(post_id):
+    started = time.perf_counter()
+    row = db.session.execute(
+        sa.select(Post.id, Post.title, Post.author_id, User.username)
+        .join(User, User.id == Post.author_id)
+        .where(Post.id == post_id)
+    ).first()
+    if row is None:
+        return 0
+
+    message = f'{row.username} has posted a new article: "{row.title}"'[:255]
+    timestamp = datetime.now(timezone.utc)
+    sent = 0
+    batches = 0
+    for ids in follower_ids(row.author_id, app.config['NOTIFICATION_CHUNK_SIZE']):
+        inserted = db.session.execute(insert_ignore(Notification).values([
+            {'user_id': id, 'post_id': row.id, 'message': message, 'is_read': False, 'timestamp': timestamp}
+            for id in ids
+        ]).returning(Notification.id, Notification.user_id)).all()
+        recipients = [user_id for _, user_id in inserted]
+        if recipients:
+            db.session.execute(
+                sa.update(User).where(User.id.in_(recipients))
+                .values(unread_notifications=User.unread_notifications + 1)
+            )
+            invalidate_on_commit(*recipients)
+        db.session.commit()
+        #live delivery to open /notifications/stream connections in this process
+        listening = set(broker.listening(recipients))
+        for notification_id, user_id in inserted:
+            if user_id in listening:
+                broker.publish(user_id, notification_event(notification_id, message, row.id, timestamp))
+        sent += len(recipients)
+        batches += 1
+
+    counters = StatCounter.__table__
+    db.session.execute(
+        sa.update(counters).where(counters.c.name == sa.bindparam('b_name'))
+        .values(value=counters.c.value + sa.bindparam('b_delta')),
+        [{'b_name': f'fan_out.{name}', 'b_delta': delta} for name, delta in
+         zip(FAN_OUT_STATS, (1, sent, batches, time.perf_counter() - started))]
+    )
+    db.session.commit()
+    return sent
+
+
+def fan_out_stats():
+    values = dict(db.session.execute(
+        sa.select(StatCounter.name, StatCounter.value)
+        .where(StatCounter.name.in_([f'fan_out.{name}' for name in FAN_OUT_STATS]))
+    ).all())
+    stats = {name: values.get(f'fan_out.{name}', 0) for name in FAN_OUT_STATS}
+    for name in ('jobs', 'notifications', 'batches'):
+        stats[name] = int(stats[name])
+    stats['per_second'] = stats['notifications'] / stats['seconds'] if stats['seconds'] else 0.0
+    return stats
+
+
+#Inbox
+def inbox(user, cursor=None, unread_only=False, per_page=20):
+    stmt = sa.select(Notification).where(Notification.user_id == user.id)
+    if unread_only:
+        stmt = stmt.where(Notification.is_read == False)
+    return keyset_page(db.session, stmt, Notification.timestamp, Notification.id, cursor=cursor, per_page=per_page)
+
+
+def mark_read(user, notification_id):
+    #the counter only moves if this call is the one that flipped is_read
+    result = db.session.execute(
+        sa.update(Notification)
+        .where(Notification.id == notification_id, Notification.user_id == user.id, Notification.is_read == False)
+        .values(is_read=True)
+    )
+    if result.rowcount:
+        db.session.execute(
+            sa.update(User)
+            .where(User.id == user.id, User.unread_notifications > 0)
+            .values(unread_notifications=User.unread_notifications - 1)
+        )
+    return result.rowcount
+
+
+def mark_all_read(user):
+    result = db.session.execute(
+        sa.update(Notification)
+        .where(Notification.user_id == user.id, Notification.is_read == False)
+        .values(is_read=True)
+    )
+    db.session.execute(sa.update(User).where(User.id == user.id).values(unread_notifications=0))
+    return result.rowcount
@@ -0,0 +1,101 @@
+import base64
+from datetime import datetime
+import sqlalchemy as sa
+
+
+#Keyset (cursor) pagination helpers
+#A cursor is the (timestamp, id) of the last row on the previous page, so the
+#next page is a plain range scan on an index instead of an OFFSET that gets
+#slower the deeper you go.
+class Page:
+    def __init__(self, items, next_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+class StreamedPage:
+    #same interface as Page, but rows are pulled in batches while the template
+    #renders; next_cursor is only known once the loop has finished. The query
+    #runs on first iteration, inside the streamed response, because the
+    #request's own session is closed as soon as the view returns.
+    def __init__(self, session, stmt, per_page, timestamp_attr='create_at', id_attr='id'):
+        self.session = session
+        self.stmt = stmt
+        self.per_page = per_page
+        self.timestamp_attr = timestamp_attr
+        self.id_attr = id_attr
+        self.next_cursor = None
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        seen = 0
+        last = None
+        result = self.session.scalars(self.stmt)
+        try:
+            for row in result:
+                if seen == self.per_page:
+                    self.next_cursor = encode_cursor(getattr(last, self.timestamp_attr), getattr(last, self.id_attr))
+                    break
+                seen += 1
+                last = row
+                yield row
+        finally:
+            result.close()
+
+
+def encode_cursor(timestamp, id):
+    raw = f'{timestamp.isoformat()}|{id}'.encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    #raises ValueError on anything that is not a cursor we produced
+    padded = cursor + '=' * (-len(cursor) % 4)
+    timestamp, id = base64.urlsafe_b64decode(padded).decode('utf-8').split('|')
+    return datetime.fromisoformat(timestamp), int(id)
+
+
+def keyset_query(stmt, timestamp_col, id_col, cursor=None, limit=20):
+    #stmt must not be ordered yet: the order is part of the cursor contract
+    if cursor:
+        timestamp, id = decode_cursor(cursor)
+        stmt = stmt.where(sa.or_(
+            timestamp_col < timestamp,
+            sa.and_(timestamp_col == timestamp, id_col < id)
+        ))
+    return stmt.order_by(timestamp_col.desc(), id_col.desc()).limit(limit)
+
+
+def make_page(rows, per_page, timestamp_attr='create_at', id_attr='id'):
+    #rows were fetched with limit per_page + 1; the extra row only says "there is more"
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, timestamp_attr), getattr(last, id_attr))
+    return Page(rows, next_cursor)
+
+
+def keyset_page(session, stmt, timestamp_col, id_col, cursor=None, per_page=20):
+    stmt = keyset_query(stmt, timestamp_col, id_col, cursor=cursor, limit=per_page + 1)
+    rows = session.scalars(stmt).all()
+    return make_page(rows, per_page, timestamp_col.key, id_col.key)
+
+
+def keyset_stream(session, stmt, timestamp_col, id_col, cursor=None, per_page=20, yield_per=100):
+    stmt = keyset_query(stmt, timestamp_col, id_col, cursor=cursor, limit=per_page + 1)
+    stmt = stmt.execution_options(yield_per=yield_per)
+    return StreamedPage(session, stmt, per_page, timestamp_col.key, id_col.key)
@@ -0,0 +1,138 @@
+import heapq
+import json
+import time
+from collections import Counter, deque
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from app import app, db
+from app.replicas import replicas
+
+
+#Per-request SQL profiling
+#Every statement on the db engine is timed and attributed to the current
+#request. The result is sent back as a Server-Timing header, written as one
+#JSON log line and kept in a small in-process history for the admin dashboard.
+#With SQL_STATEMENT_BUDGET set (see config.Testing) a page render (GET) that
+#issues more statements than the budget fails the request under
+#SQL_STATEMENT_BUDGET_STRICT, so an N+1 regression breaks the test run
+#instead of shipping; elsewhere it logs a warning. Writes do legitimately
+#more work and aren't checked, unless SQL_STATEMENT_BUDGETS gives their
+#endpoint a budget of its own.
+class RequestProfile:
+    def __init__(self, keep_slowest=5):
+        self.count = 0
+        self.db_time = 0.0
+        self.statements = Counter()
+        self.slowest = []
+        self.keep_slowest = keep_slowest
+
+    def record(self, statement, elapsed):
+        self.count += 1
+        self.db_time += elapsed
+        self.statements[statement] += 1
+        #min-heap of the N slowest, the fastest of them sits on top
+        entry = (elapsed, self.count, statement)
+        if len(self.slowest) < self.keep_slowest:
+            heapq.heappush(self.slowest, entry)
+        elif elapsed > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, entry)
+
+    def duplicates(self):
+        #same SQL text run more than once in one request: the N+1 signature
+        return [(statement, n) for statement, n in self.statements.most_common() if n > 1]
+
+    def slowest_statements(self):
+        return [(statement, elapsed) for elapsed, _, statement in sorted(self.slowest, reverse=True)]
+
+
+history = deque(maxlen=app.config['SQL_PROFILER_HISTORY'])
+
+
+def current_profile():
+    if 'sql_profile' not in g:
+        g.sql_profile = RequestProfile(app.config['SQL_PROFILER_SLOWEST'])
+    return g.sql_profile
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and conn.info.get('query_start'):
+        elapsed = time.perf_counter() - conn.info['query_start'].pop()
+        current_profile().record(statement, elapsed)
+
+
+with app.app_context():
+    for engine in (db.engine, *replicas.engines):
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+
+
+@app.before_request
+def start_profile():
+    g.request_started = time.perf_counter()
+    current_profile()
+
+
+def statement_budget():
+    budgets = app.config.get('SQL_STATEMENT_BUDGETS') or {}
+    if request.endpoint in budgets:
+        return budgets[request.endpoint]
+    if request.method in ('GET', 'HEAD'):
+        return app.config.get('SQL_STATEMENT_BUDGET')
+    return None
+
+
+@app.after_request
+def finish_profile(response):
+    profile = current_profile()
+    budget = statement_budget()
+    if budget is not None and profile.count > budget:
+        message = f'{request.method} {request.endpoint} issued {profile.count} SQL statements, budget is {budget}'
+        if app.config['SQL_STATEMENT_BUDGET_STRICT']:
+            raise AssertionError(message)
+        app.logger.warning(message)
+
+    if app.config['SQL_PROFILER']:
+        total_ms = (time.perf_counter() - g.get('request_started', time.perf_counter())) * 1000
+        db_ms = profile.db_time * 1000
+        response.headers.add(
+            'Server-Timing',
+            f'db;dur={db_ms:.2f};desc="{profile.count} queries", app;dur={total_ms:.2f}'
+        )
+        summary = {
+            'endpoint': request.endpoint,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'statements': profile.count,
+            'db_ms': round(db_ms, 2),
+            'total_ms': round(total_ms, 2),
+            'duplicates': len(profile.duplicates()),
+            'slowest': [[statement, round(elapsed * 1000, 2)] for statement, elapsed in profile.slowest_statements()],
+        }
+        app.logger.info('sql_profile %s', json.dumps(summary))
+        history.append(summary)
+    return response
+
+
+def endpoint_summary():
+    #aggregate of the recent history, worst average DB time first
+    by_endpoint = {}
+    for entry in history:
+        stats = by_endpoint.setdefault(entry['endpoint'], {
+            'endpoint': entry['endpoint'], 'requests': 0, 'statements': 0,
+            'db_ms': 0.0, 'max_db_ms': 0.0, 'duplicates': 0,
+        })
+        stats['requests'] += 1
+        stats['statements'] += entry['statements']
+        stats['db_ms'] += entry['db_ms']
+        stats['max_db_ms'] = max(stats['max_db_ms'], entry['db_ms'])
+        stats['duplicates'] += entry['duplicates']
+    for stats in by_endpoint.values():
+        stats['avg_statements'] = stats['statements'] / stats['requests']
+        stats['avg_db_ms'] = stats['db_ms'] / stats['requests']
+    return sorted(by_endpoint.values(), key=lambda s: s['avg_db_ms'], reverse=True)
@@ -0,0 +1,30 @@
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+from app.models import Post, User
+
+
+#Loader options per page type
+#Every template that walks a relationship declares it here, so a page of N
+#posts costs a fixed number of queries instead of one lazy load per post.
+def post_card_options():
+    #index.html / posts.html: avatar and username of the author, the stored
+    #excerpt instead of the body (touching body on a card raises)
+    return (so.joinedload(Post.author), so.defer(Post.body, raiseload=True))
+
+
+def post_detail_options():
+    #_post.html: author, category badge, the tag list and the rendered body
+    return (
+        so.undefer(Post.body_html),
+        so.joinedload(Post.author),
+        so.joinedload(Post.category),
+        so.selectinload(Post.tags),
+    )
+
+
+def profile_options():
+    return (so.selectinload(User.roles),)
+
+
+def select_post_cards():
+    return sa.select(Post).options(*post_card_options())
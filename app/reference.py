@@ -0,0 +1,127 @@
+import threading
+import time
+from flask import g, has_app_context
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+from sqlalchemy import event
+from app import app, db
+from app.models import Category, Role
+from app.replicas import use_primary
+from app.generations import read_generation, increment_generation
+
+
+#Cached reference data: categories and roles
+#Both tables are small, read on every post form and role page and written
+#almost never, so each worker keeps one immutable snapshot of them. The
+#cache_generations row 'reference' (see app/generations.py) is bumped in the
+#same transaction as any change to them: the ORM ones through the flush hook
+#below, Core writes by calling bump_generation(). The writing worker drops
+#its snapshot on commit; the others compare generations at most every
+#REFERENCE_CACHE_TTL seconds and reload when it moved. A request keeps the
+#snapshot it started with (reference_data()), so a form and its validation
+#agree on the choices.
+#Tags aren't in here: every new post can create some, and their counts move
+#on every write; the post form gets them from /tags/suggest instead.
+GENERATION = 'reference'
+
+
+class ReferenceData:
+    def __init__(self, generation, categories, roles):
+        self.generation = generation
+        #(id, name, description) rows, ordered by id
+        self.categories = categories
+        self.roles = roles
+        self.roles_by_name = {role.name: role for role in roles}
+
+    @property
+    def category_choices(self):
+        return [(category.id, category.name) for category in self.categories]
+
+
+def current_generation():
+    return read_generation(GENERATION)
+
+
+def load_reference_data(generation):
+    return ReferenceData(
+        generation,
+        categories=tuple(db.session.execute(
+            sa.select(Category.id, Category.name, Category.description).order_by(Category.id)
+        ).all()),
+        roles=tuple(db.session.execute(sa.select(Role.id, Role.name, Role.description).order_by(Role.id)).all()),
+    )
+
+
+class ReferenceCache:
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.snapshot = None
+        self.checked_at = float('-inf')
+        self.version = 0
+        self.lock = threading.Lock()
+
+    def get(self):
+        with self.lock:
+            snapshot = self.snapshot
+            if snapshot is not None and time.monotonic() - self.checked_at < self.ttl:
+                return snapshot
+            version = self.version
+
+        #from the primary, like the identity cache: a lagging replica would
+        #hand back the generation and rows from before the write
+        with use_primary():
+            generation = current_generation()
+            if snapshot is None or snapshot.generation != generation:
+                snapshot = load_reference_data(generation)
+
+        with self.lock:
+            #a load that raced with an invalidation may predate the write
+            if self.version == version:
+                self.snapshot = snapshot
+                self.checked_at = time.monotonic()
+        return snapshot
+
+    def invalidate(self):
+        with self.lock:
+            self.version += 1
+            self.snapshot = None
+
+
+reference_cache = ReferenceCache(app.config['REFERENCE_CACHE_TTL'])
+
+
+def reference_data():
+    #one snapshot per request
+    if not has_app_context():
+        return reference_cache.get()
+    if 'reference_data' not in g:
+        g.reference_data = reference_cache.get()
+    return g.reference_data
+
+
+def bump_generation(session=None):
+    session = session or db.session
+    increment_generation(GENERATION, session)
+    session.info['reference_changed'] = True
+
+
+@event.listens_for(so.Session, 'after_flush')
+def track_reference_changes(session, flush_context):
+    if session.info.get('reference_changed'):
+        return
+    for obj in session.new | session.dirty | session.deleted:
+        if isinstance(obj, (Category, Role)) and (obj in session.new or obj in session.deleted
+                                                  or session.is_modified(obj, include_collections=False)):
+            bump_generation(session)
+            return
+
+
+@event.listens_for(so.Session, 'after_commit')
+def invalidate_reference_data(session):
+    if session.info.pop('reference_changed', False):
+        reference_cache.invalidate()
+
+
+@event.listens_for(so.Session, 'after_rollback')
+def forget_reference_changes(session):
+    session.info.pop('reference_changed', None)
@@ -0,0 +1,122 @@
+import hashlib
+import threading
+from collections import OrderedDict
+import markdown as markdown_lib
+from markdown import Markdown
+from markdown.extensions import Extension
+from markdown.treeprocessors import Treeprocessor
+from app import app
+
+
+#Markdown rendering for post bodies
+#Bodies are user input, so raw HTML is escaped instead of passed through and
+#links/images may only use safe schemes. The output is stored on the post
+#(Post.body_html) and shown with |safe.
+SAFE_SCHEMES = ('http:', 'https:', 'mailto:')
+
+
+class SafeLinks(Treeprocessor):
+    def run(self, root):
+        for element in root.iter():
+            for attr in ('href', 'src'):
+                url = element.get(attr)
+                if url is None:
+                    continue
+                scheme = url.strip().lower().split('/', 1)[0]
+                if ':' in scheme and not scheme.startswith(SAFE_SCHEMES):
+                    element.set(attr, '#')
+
+
+class EscapeHtml(Extension):
+    def extendMarkdown(self, md):
+        md.preprocessors.deregister('html_block')
+        md.inlinePatterns.deregister('html')
+        md.treeprocessors.register(SafeLinks(md), 'safe_links', 0)
+
+
+#A Markdown instance keeps parser state between calls, so each thread gets its own
+EXTENSIONS = ['escape_html']
+_local = threading.local()
+
+
+def get_markdown():
+    md = getattr(_local, 'markdown', None)
+    if md is None:
+        md = _local.markdown = Markdown(extensions=[EscapeHtml()])
+    return md
+
+
+#Anything that changes the output must be part of the cache key
+CONFIG_FINGERPRINT = f'{markdown_lib.__version__}|{",".join(EXTENSIONS)}|{",".join(SAFE_SCHEMES)}'
+
+
+def cache_key(text):
+    digest = hashlib.sha256(CONFIG_FINGERPRINT.encode('utf-8'))
+    digest.update(text.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class RenderCache:
+    #LRU bounded by the total size of the cached html, not by entry count
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            html = self.entries.get(key)
+            if html is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return html
+
+    def put(self, key, html):
+        cost = len(html.encode('utf-8'))
+        if cost > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                return
+            self.entries[key] = html
+            self.size += cost
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted.encode('utf-8'))
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+render_cache = RenderCache(app.config['MARKDOWN_CACHE_BYTES'])
+
+
+def render_markdown(text):
+    key = cache_key(text)
+    html = render_cache.get(key)
+    if html is None:
+        html = get_markdown().reset().convert(text)
+        render_cache.put(key, html)
+    return html
@@ -0,0 +1,46 @@
+import time
+from contextlib import contextmanager
+from flask import has_request_context, request, session
+import sqlalchemy.orm as so
+from sqlalchemy import event
+from app import app, db
+from app.database import engine_options, replicas
+
+
+#Read-replica routing, per request
+#GET and HEAD requests may read from the replicas in SQLALCHEMY_REPLICAS (see
+#RoutingSession in app/database.py); other methods, jobs and CLI commands use
+#the primary only. After a request commits a write, the user's requests stay
+#on the primary for REPLICA_STICKY_SECONDS (a timestamp in the session cookie),
+#so the page they are redirected to shows what they just wrote even if the
+#replicas lag behind.
+replicas.configure([(uri, engine_options(app.config, uri)) for uri in app.config['SQLALCHEMY_REPLICAS']],
+                   app.config['REPLICA_RETRY_INTERVAL'])
+
+
+@app.before_request
+def route_reads():
+    if replicas.engines and request.method in ('GET', 'HEAD'):
+        db.session.info['use_replica'] = session.get('primary_until', 0) < time.time()
+
+
+@contextmanager
+def use_primary():
+    #for reads that must not lag, e.g. what gets cached across requests
+    previous = db.session.info.get('use_replica')
+    db.session.info['use_replica'] = False
+    try:
+        yield
+    finally:
+        db.session.info['use_replica'] = previous
+
+
+@event.listens_for(so.Session, 'after_commit')
+def stick_to_primary(db_session):
+    if db_session.info.pop('wrote', False) and replicas.engines and has_request_context():
+        session['primary_until'] = time.time() + app.config['REPLICA_STICKY_SECONDS']
+
+
+@event.listens_for(so.Session, 'after_rollback')
+def forget_rolled_back_writes(db_session):
+    db_session.info.pop('wrote', None)
@@ -1,12 +1,27 @@
-from flask import render_template, redirect, flash, url_for, request, abort
+from flask import render_template, redirect, flash, url_for, request, abort, stream_template, jsonify
 from app import app, db
 import sqlalchemy as sa
-from app.forms import LoginForm, RegisterForm, PostForm, CategoryForm
-from app.models import User, Role, Post, Category, Tag, Notification
+from app.forms import LoginForm, RegisterForm, PostForm, CategoryForm, EmptyForm
+from app.models import User, Role, Post, Category, Tag, SlugHistory
+from app.feed import home_feed
+from app import timeline, profiler, jobs, events
+from app.rendering import render_cache, render_markdown
+from app.search import search_posts
+from app.taxonomy import tag_page, category_page, suggest_tags
+from app.reference import reference_data
+from app.generations import posts_generation
+from app.services import TagService
+from app.notifications import notify_followers, fan_out_stats, inbox, mark_read, mark_all_read
+from app.identity import invalidate_on_commit
+from app.queries import post_detail_options, profile_options, select_post_cards
+from app.pagination import keyset_page, keyset_stream
+from app.http_cache import conditional, check
+from app.fragments import fragment_stats
+from app.database import pool_stats, sqlite_settings, replicas
 from flask_login import current_user, login_user, logout_user, login_required
 from urllib.parse import urlsplit
 from functools import wraps
-from slugify import slugify
+from datetime import datetime, timezone
 import time
 
 #Check role of user
@@ -26,13 +41,11 @@ def role_required(role_name):
 @app.route('/home')
 @login_required
 def home():
-    if current_user.is_authenticated:
-        #getting list of ids [followed and user.authenticated]
-        following_ids = [user.id for user in current_user.followed]
-        following_ids.append(current_user.id)
-        
-        #fetch posts from all the ids
-        posts = Post.query.filter(Post.author_id.in_(following_ids)).order_by(Post.create_at.desc()).all()
+    #one page of posts from followed users + own posts, newest first
+    try:
+        posts = home_feed(current_user, cursor=request.args.get('cursor'))
+    except ValueError:
+        abort(400)
 
     return render_template('index.html', title='Home', posts=posts)
 
@@ -59,9 +72,16 @@ def login():
 #Profile
 @app.route('/profile/<username>')
 @login_required
+@conditional()
 def profile(username):
-    user = User.query.filter_by(username=username).first_or_404()
-    return render_template('profile.html', user=user, title='Profile')
+    user = User.query.options(*profile_options()).filter_by(username=username).first_or_404()
+    following = user.id != current_user.id and current_user.is_following(user)
+    #users have no update_at: the page is validated on everything it shows
+    not_modified = check((user.id, user.username, user.email, user.bio, user.followers_count,
+                          user.following_count, sorted(role.name for role in user.roles), following))
+    if not_modified:
+        return not_modified
+    return render_template('profile.html', user=user, following=following, title='Profile')
 
 
 #Register new users
@@ -89,21 +109,44 @@ def assign_role(user_id):
         return redirect(url_for('home'))
     
     user = User.query.get_or_404(user_id)
-    roles = Role.query.all()
+    roles = reference_data().roles
     
     if request.method == 'POST':
-        selected_roles = request.form.getlist('roles')
-        user.roles.clear() #clear existing roles
-        for role_name in selected_roles:
-            role = Role.query.filter_by(name=role_name).first()
-            if role:
-                user.add_role(role)
+        #names resolve against the cached roles, then one query for the rows
+        roles_by_name = reference_data().roles_by_name
+        role_ids = [roles_by_name[name].id for name in request.form.getlist('roles') if name in roles_by_name]
+        user.roles = Role.query.filter(Role.id.in_(role_ids)).all() if role_ids else []
                 
+        invalidate_on_commit(user.id)
         db.session.commit()
         flash(f"Roles updated for {user.username}", 'success')
-        return redirect(url_for('user_list'))
+        return redirect(url_for('profile', username=user.username))
     return render_template('assign_role.html', title='Assign Roles' ,user=user, roles=roles)
 
+#Health check for load balancers: database round trip and pool counters
+@app.route('/health')
+def health():
+    #anyone (load balancers, uptime checks) gets the status and the pool
+    #counters; dialect, pragmas and replica urls are for admins only
+    engine = db.engine
+    status = 'ok'
+    database = {'dialect': engine.dialect.name}
+    started = time.perf_counter()
+    try:
+        with engine.connect() as conn:
+            conn.execute(sa.text('SELECT 1'))
+            if engine.dialect.name == 'sqlite':
+                database['settings'] = sqlite_settings(conn)
+        database['latency_ms'] = round((time.perf_counter() - started) * 1000, 2)
+    except sa.exc.SQLAlchemyError as e:
+        app.logger.error('Health check failed: %s', e)
+        status = 'error'
+    pool = pool_stats.snapshot(engine.pool)
+    report = {'status': status, 'pool': {k: v for k, v in pool.items() if k != 'pool'}}
+    if current_user.is_authenticated and current_user.has_role('Admin'):
+        report.update(database=database, pool=pool, replicas=replicas.status())
+    return jsonify(report), 200 if status == 'ok' else 503
+
 #Dasboard: endpoint able just for admin users
 @app.route('/admin/dashboard')
 @login_required
@@ -112,7 +155,14 @@ def admin_dashboard():
     if not current_user.has_role('Admin'):
         flash("You are not authorized to access this page.", 'danger')
         return redirect(url_for('home'))
-    return render_template('dashboard.html')
+    return render_template('dashboard.html',
+                           title='Dashboard',
+                           endpoints=profiler.endpoint_summary(),
+                           recent=list(reversed(profiler.history))[:20],
+                           render_stats=render_cache.stats(),
+                           fragment_stats=fragment_stats(),
+                           fan_out=fan_out_stats(),
+                           job_counts=jobs.job_stats())
 
 #Create new post
 @app.route("/post/new", methods=['GET', 'POST'])
@@ -120,78 +170,143 @@ def admin_dashboard():
 def new_post():
     form = PostForm()
     
-    form.category_id.choices = [(c.id, c.name) for c in Category.query.all()]
-    
-   # form.tags.choices = [(t.id, t.name) for t in Tag.query.all()]
+    form.category_id.choices = reference_data().category_choices
     
     if form.validate_on_submit():
         
-        #generate slug from title
-        slug = slugify(form.title.data)
+        #Process tags: '#'-separated names, resolved/created in one batch
+        tags = TagService.resolve_many(TagService.parse(form.tags.data))
         
-        #check if exist slug and adjust if any
-        existing_post = Post.query.filter_by(slug=slug).first()
-        if existing_post:
-            slug = f'{slug}-{int(time.time())}'
-            
-            
         #create post
+        #the slug is allocated on insert, see generate_slug_before_insert
         post = Post(
             title=form.title.data,
-            slug=slug,
             body=form.body.data,
             category_id = form.category_id.data,
-            #tags = form.tags.data,
+            tags = tags,
             author_id = current_user.id
         )        
-    
-        
-        #Process tags
-        raw_tags = form.tags.data
-        tag_list= [tag.strip() for tag in raw_tags.split("#") if tag.strip()]
-        
-        for tag_name in tag_list:
-            tag= Tag.query.filter_by(name=tag_name).first()
-            if not tag:
-                tag = Tag(name=tag_name)
-                db.session.add(tag)
-            post.tags.append(tag)
         
 
         #Save in DB
         db.session.add(post)
+        if timeline.timeline_enabled():
+            timeline.choose_delivery(post)
         
-        followers = current_user.followed
+        db.session.flush()
+        if timeline.timeline_enabled():
+            timeline.fan_out_post(post)
         
-        for follower in followers:
-            print(follower)
-            notification = Notification(user_id=follower.id, message=f'{current_user.username} has posted a new article: "{post.title}"')
-            db.session.add(notification)
+        #notify followers off the request path, queued in the same transaction
+        jobs.enqueue(notify_followers, post_id=post.id, idempotency_key=f'notify_followers:{post.id}')
         
         db.session.commit()
         
         flash('Post created successfully!', 'success')
         return redirect(url_for('home'))
     
-    all_tags = Tag.query.all()
-    existing_tags = [tag.name for tag in all_tags]
-    
-    return render_template('create_post.html', form=form,  existing_tags=existing_tags)
+    #tag names come from /tags/suggest as the user types
+    return render_template('create_post.html', form=form)
+
+def post_validators(slug):
+    row = db.session.execute(
+        sa.select(Post.id, Post.update_at, User.username).join(Post.author).where(Post.slug == slug)
+    ).first()
+    if row is None:
+        return None
+    return tuple(row), row.update_at
+
+
+def archive_validators():
+    #every post written moves the posts generation: one primary key lookup
+    #instead of an aggregate over the table
+    return (posts_generation(), app.config['ARCHIVE_PER_PAGE']), None
 
 #Read post by slug
 @app.route('/post/<slug>')
 @login_required
+@conditional(post_validators)
 def read_post(slug):
-    post = Post.query.filter_by(slug=slug).first_or_404()
-    return render_template('_post.html', post=post)
+    post = Post.query.options(*post_detail_options()).filter_by(slug=slug).first()
+    if post is None:
+        #renamed posts keep answering on their old slugs
+        current = db.session.scalar(
+            sa.select(Post.slug).join(SlugHistory, SlugHistory.post_id == Post.id).where(SlugHistory.slug == slug)
+        )
+        if current is None:
+            abort(404)
+        return redirect(url_for('read_post', slug=current), 301)
+    #body_html is stored on save; posts not backfilled yet go through the render cache
+    body_html = post.body_html if post.body_html is not None else render_markdown(post.body)
+    return render_template('_post.html', post=post, body_html=body_html)
 
 #Read All posts
 @app.route('/posts')
 @login_required
+@conditional(archive_validators)
 def read_all_posts():
-    posts = Post.query.all()
+    cursor = request.args.get('cursor')
+    per_page = app.config['ARCHIVE_PER_PAGE']
+    try:
+        if app.config['STREAM_ARCHIVE']:
+            #rows are fetched in batches while the page is sent; stream_template
+            #keeps the request context alive until the last chunk
+            posts = keyset_stream(db.session, select_post_cards(), Post.create_at, Post.id,
+                                  cursor=cursor, per_page=per_page)
+            return app.response_class(stream_template('posts.html', posts=posts))
+        posts = keyset_page(db.session, select_post_cards(), Post.create_at, Post.id,
+                            cursor=cursor, per_page=per_page)
+    except ValueError:
+        abort(400)
     return render_template('posts.html', posts=posts)
 
+#Posts by tag and by category, newest first
+@app.route('/tag/<name>')
+@login_required
+def tag_posts(name):
+    tag = Tag.query.filter_by(name=name).first_or_404()
+    try:
+        posts = tag_page(tag, cursor=request.args.get('cursor'), per_page=app.config['BROWSE_PER_PAGE'])
+    except ValueError:
+        abort(400)
+    next_url = url_for('tag_posts', name=tag.name, cursor=posts.next_cursor) if posts.has_next else None
+    return render_template('browse.html', title=f'#{tag.name}', heading=f'#{tag.name}',
+                           post_count=tag.post_count, posts=posts, next_url=next_url)
+
+
+@app.route('/category/<int:id>')
+@login_required
+def category_posts(id):
+    category = Category.query.get_or_404(id)
+    try:
+        posts = category_page(category, cursor=request.args.get('cursor'), per_page=app.config['BROWSE_PER_PAGE'])
+    except ValueError:
+        abort(400)
+    next_url = url_for('category_posts', id=category.id, cursor=posts.next_cursor) if posts.has_next else None
+    return render_template('browse.html', title=category.name, heading=category.name,
+                           description=category.description, post_count=category.post_count,
+                           posts=posts, next_url=next_url)
+
+
+#Tag autocomplete for the post form: [{"name": ..., "post_count": ...}]
+@app.route('/tags/suggest')
+@login_required
+def tag_suggestions():
+    tags = suggest_tags(request.args.get('q', ''))
+    return jsonify([{'name': name, 'post_count': post_count} for name, post_count in tags])
+
+
+#Full-text search over title, body and tags
+@app.route('/search')
+@login_required
+def search():
+    query = request.args.get('q', '').strip()
+    page = min(max(request.args.get('page', 1, type=int), 1), app.config['SEARCH_MAX_PAGE'])
+    per_page = app.config['SEARCH_PER_PAGE']
+    hits = search_posts(query, page=page, per_page=per_page) if query else []
+    return render_template('search.html', title='Search', query=query, hits=hits,
+                           page=page, has_next=len(hits) == per_page and page < app.config['SEARCH_MAX_PAGE'])
+
 #Update post by slug
 @app.route('/post/<slug>/edit', methods=['GET', 'POST'])
 @login_required
@@ -203,9 +318,7 @@ def update_post(slug):
         flash('You do not have permission to delete this post.', 'danger')
         return redirect(url_for('home'))
     
-    form.category_id.choices = [(c.id, c.name) for c in Category.query.all()]
-    
-    form.tags.choices = [(t.id, t.name) for t in Tag.query.all()]
+    form.category_id.choices = reference_data().category_choices
     
     if form.validate_on_submit():
         post.title = form.title.data
@@ -215,18 +328,11 @@ def update_post(slug):
         
         raw_tags = form.tags.data
         if raw_tags:
-            tag_list= [tag.strip() for tag in raw_tags.split("#") if tag.strip()]
-            
-            post.tags=[]
-        
-            for tag_name in tag_list:
-                tag= Tag.query.filter_by(name=tag_name).first()
-                if not tag:
-                    tag = Tag(name=tag_name)
-                    db.session.add(tag)
-                post.tags.append(tag)
-        
+            post.tags = TagService.resolve_many(TagService.parse(raw_tags))
         
+        #a tags-only edit issues no UPDATE on posts, and the cached pages
+        #are validated on update_at
+        post.update_at = datetime.now(timezone.utc)
         
         db.session.commit()
         flash('Post updated successfully!', 'success')
@@ -244,6 +350,8 @@ def delete_post(slug):
         flash('You do not have permission to delete this post.', 'danger')
         return redirect(url_for('home'))
     
+    if timeline.timeline_enabled():
+        timeline.remove_post(post)
     db.session.delete(post)
     db.session.commit()
     return redirect(url_for('home'))
@@ -272,8 +380,9 @@ def follow(username):
         flash('You cannot follow yourself!')
         return redirect(url_for('profile', username=username))
     
-    if not current_user.is_following(user_to_follow):
-        current_user.follow(user_to_follow)
+    if current_user.follow(user_to_follow):
+        if timeline.timeline_enabled():
+            timeline.on_follow(current_user, user_to_follow)
         db.session.commit()
         flash(f'You are now following {username}!')
     else:
@@ -289,8 +398,9 @@ def unfollow(username):
     if user_to_unfollow == current_user:
         flash("You cannot unfollow yourself!")
         return redirect(url_for('profile', username=username))
-    if current_user.is_following(user_to_unfollow):
-        current_user.unfollow(user_to_unfollow)
+    if current_user.unfollow(user_to_unfollow):
+        if timeline.timeline_enabled():
+            timeline.on_unfollow(current_user, user_to_unfollow)
         db.session.commit()
         flash(f'You have unfollowed {username}')
     else:
@@ -301,8 +411,60 @@ def unfollow(username):
 @app.route('/notifications')
 @login_required
 def notifications():
-    user_notifications = Notification.query.filter_by(user_id=current_user.id).order_by(Notification.timestamp.desc()).all()
-    return render_template('notifications.html', notifications=user_notifications)
+    unread_only = request.args.get('unread') == '1'
+    try:
+        page = inbox(current_user, cursor=request.args.get('cursor'), unread_only=unread_only,
+                     per_page=app.config['NOTIFICATIONS_PER_PAGE'])
+    except ValueError:
+        abort(400)
+    return render_template('notifications.html', title='Notifications', notifications=page,
+                           unread_only=unread_only, form=EmptyForm())
+
+#Live notifications: the stream holds a bounded in-memory queue, not a DB connection
+@app.route('/notifications/stream')
+@login_required
+def notifications_stream():
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        abort(400)
+
+    subscriber = events.broker.subscribe(current_user.id, app.config['SSE_BUFFER_SIZE'],
+                                         app.config['SSE_MAX_STREAMS'], app.config['SSE_STREAMS_PER_USER'])
+    if subscriber is None:
+        return app.response_class('Too many open streams', status=503,
+                                  headers={'Retry-After': str(app.config['SSE_RETRY_MS'] // 1000)})
+
+    #the generator outlives the request: hand it the engine, not the session
+    body = events.stream(db.engine, subscriber, last_event_id)
+    response = app.response_class(body, mimetype='text/event-stream',
+                                  headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    #the generator's finally only runs once it has started; a HEAD request or
+    #a client gone before the first chunk would otherwise keep the slot
+    response.call_on_close(lambda: events.broker.unsubscribe(subscriber))
+    return response
+
+@app.route('/notifications/<int:notification_id>/read', methods=['POST'])
+@login_required
+def read_notification(notification_id):
+    form = EmptyForm()
+    if form.validate_on_submit():
+        mark_read(current_user, notification_id)
+        invalidate_on_commit(current_user.id)
+        db.session.commit()
+    return redirect(request.referrer or url_for('notifications'))
+
+@app.route('/notifications/read-all', methods=['POST'])
+@login_required
+def read_all_notifications():
+    form = EmptyForm()
+    if form.validate_on_submit():
+        mark_all_read(current_user)
+        invalidate_on_commit(current_user.id)
+        db.session.commit()
+        flash('All notifications marked as read.')
+    return redirect(url_for('notifications'))
 
 
 @app.route('/logout')
@@ -0,0 +1,300 @@
+import bisect
+import heapq
+import math
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter, defaultdict
+from markupsafe import Markup, escape
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+from sqlalchemy import event
+from werkzeug.utils import import_string
+from app import app, db
+from app.models import Post, Tag, post_tags
+from app.queries import select_post_cards
+from app.generations import POSTS, read_generation
+
+
+#Full-text search over post title, body and tag names
+#On SQLite the index is the posts_fts FTS5 table, kept in sync by triggers
+#(see migration 2d9b7e4f6a18) and ranked with bm25. Other databases fall back
+#to an in-process inverted index. SEARCH_BACKEND picks one: 'auto', 'fts5',
+#'memory' or the import path of a class with the same interface.
+#The in-process index is a fallback for development and small sites: every
+#worker holds a full copy, applies its own commits right away and reloads
+#everything when the posts generation (app/generations.py) moved, which it
+#checks at most every SEARCH_INDEX_CHECK seconds. Writes from other workers,
+#job workers and Core (flask import) show up after that delay, and each one
+#costs every worker a full reload.
+TOKEN_RE = re.compile(r'\w+')
+MARK_START = '\x02'
+MARK_END = '\x03'
+SNIPPET_WORDS = 16
+
+
+def tokenize(text):
+    #same folding as the FTS5 tokenizer: lowercase, diacritics removed
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return TOKEN_RE.findall(text)
+
+
+def parse_query(query):
+    #list of (term, is_prefix); 'pyth*' is a prefix query, everything else is exact
+    terms = []
+    for word in query.split():
+        tokens = tokenize(word)
+        terms.extend((token, False) for token in tokens)
+        if tokens and word.endswith('*'):
+            terms[-1] = (terms[-1][0], True)
+    return terms
+
+
+def highlight(snippet):
+    #the snippet is raw post text: escape it, then turn the markers into <mark>
+    text = str(escape(snippet))
+    return Markup(text.replace(MARK_START, '<mark>').replace(MARK_END, '</mark>'))
+
+
+class SearchHit:
+    def __init__(self, post, snippet):
+        self.post = post
+        self.snippet = snippet
+
+
+class Fts5Backend:
+    name = 'fts5'
+
+    def search(self, terms, limit, offset=0):
+        #terms are \w+ tokens, so quoting them is enough to neutralise FTS syntax
+        match = ' '.join(f'"{term}"*' if prefix else f'"{term}"' for term, prefix in terms)
+        rows = db.session.execute(sa.text(
+            "SELECT rowid, snippet(posts_fts, -1, :start, :end, '…', :words) "
+            "FROM posts_fts WHERE posts_fts MATCH :match "
+            "ORDER BY rank LIMIT :limit OFFSET :offset"
+        ), {'start': MARK_START, 'end': MARK_END, 'words': SNIPPET_WORDS,
+            'match': match, 'limit': limit, 'offset': offset}).all()
+        return [(id, snippet) for id, snippet in rows]
+
+    def rebuild(self):
+        db.session.execute(sa.text('DELETE FROM posts_fts'))
+        result = db.session.execute(sa.text(
+            "INSERT INTO posts_fts (rowid, title, body, tags) "
+            "SELECT p.id, p.title, p.body, coalesce(("
+            "SELECT group_concat(t.name, ' ') FROM post_tags pt JOIN tags t ON t.id = pt.tag_id "
+            "WHERE pt.post_id = p.id), '') FROM posts p"
+        ))
+        db.session.execute(sa.text("INSERT INTO posts_fts (posts_fts) VALUES ('optimize')"))
+        db.session.commit()
+        return result.rowcount
+
+
+class InvertedIndex:
+    #BM25 over an in-memory term -> {post_id: weighted tf} map, per worker.
+    #Title and tag matches weigh more than body matches, as in the FTS5 rank.
+    name = 'memory'
+    field_weights = {'title': 10, 'body': 1, 'tags': 5}
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.reset()
+
+    def reset(self):
+        self.postings = defaultdict(dict)
+        self.doc_terms = {}
+        self.doc_length = {}
+        self.total_length = 0
+        self.sorted_terms = None
+        self.built = False
+        #posts generation the index was loaded at
+        self.generation = None
+        self.checked_at = float('-inf')
+
+    def add(self, post_id, title, body, tags):
+        weighted = Counter()
+        for field, text in (('title', title), ('body', body), ('tags', tags)):
+            for token in tokenize(text or ''):
+                weighted[token] += self.field_weights[field]
+        with self.lock:
+            self.remove(post_id)
+            for term, tf in weighted.items():
+                self.postings[term][post_id] = tf
+            self.doc_terms[post_id] = list(weighted)
+            self.doc_length[post_id] = sum(weighted.values())
+            self.total_length += self.doc_length[post_id]
+            self.sorted_terms = None
+
+    def remove(self, post_id):
+        with self.lock:
+            for term in self.doc_terms.pop(post_id, ()):
+                docs = self.postings[term]
+                docs.pop(post_id, None)
+                if not docs:
+                    del self.postings[term]
+            self.total_length -= self.doc_length.pop(post_id, 0)
+            self.sorted_terms = None
+
+    def expand(self, term, prefix):
+        if not prefix:
+            return [term] if term in self.postings else []
+        if self.sorted_terms is None:
+            self.sorted_terms = sorted(self.postings)
+        start = bisect.bisect_left(self.sorted_terms, term)
+        end = bisect.bisect_left(self.sorted_terms, term + '\uffff')
+        return self.sorted_terms[start:end]
+
+    def search(self, terms, limit, offset=0):
+        self.ensure_built()
+        with self.lock:
+            docs = len(self.doc_length)
+            if not docs:
+                return []
+            average_length = self.total_length / docs
+            scores = None
+            #every query term must match (implicit AND, like FTS5)
+            for term, prefix in terms:
+                term_scores = defaultdict(float)
+                for expanded in self.expand(term, prefix):
+                    postings = self.postings[expanded]
+                    idf = math.log(1 + (docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                    for post_id, tf in postings.items():
+                        norm = self.k1 * (1 - self.b + self.b * self.doc_length[post_id] / average_length)
+                        term_scores[post_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {post_id: score + term_scores[post_id]
+                              for post_id, score in scores.items() if post_id in term_scores}
+                if not scores:
+                    return []
+            top = heapq.nlargest(offset + limit, scores.items(), key=lambda item: (item[1], item[0]))
+        ids = [post_id for post_id, _ in top[offset:]]
+        bodies = dict(db.session.execute(sa.select(Post.id, Post.body).where(Post.id.in_(ids))).all())
+        return [(post_id, self.snippet(bodies.get(post_id, ''), terms)) for post_id in ids]
+
+    def snippet(self, body, terms):
+        words = body.split()
+
+        def matches(word):
+            tokens = tokenize(word)
+            return any(token == term or (prefix and token.startswith(term))
+                       for token in tokens for term, prefix in terms)
+
+        hit = next((i for i, word in enumerate(words) if matches(word)), 0)
+        start = max(0, hit - SNIPPET_WORDS // 2)
+        window = words[start:start + SNIPPET_WORDS]
+        text = ' '.join(f'{MARK_START}{word}{MARK_END}' if matches(word) else word for word in window)
+        if start > 0:
+            text = '…' + text
+        if start + SNIPPET_WORDS < len(words):
+            text += '…'
+        return text
+
+    def load(self, conn, post_ids=None):
+        #(re)index posts straight from the tables, tags grouped per post in Python
+        posts = sa.select(Post.id, Post.title, Post.body)
+        tags = sa.select(post_tags.c.post_id, Tag.name).join(Tag, Tag.id == post_tags.c.tag_id)
+        if post_ids is not None:
+            posts = posts.where(Post.id.in_(post_ids))
+            tags = tags.where(post_tags.c.post_id.in_(post_ids))
+        names = defaultdict(list)
+        for post_id, name in conn.execute(tags):
+            names[post_id].append(name)
+        count = 0
+        for post_id, title, body in conn.execute(posts.execution_options(yield_per=1000)):
+            self.add(post_id, title, body, ' '.join(names[post_id]))
+            count += 1
+        return count
+
+    def is_fresh(self):
+        return self.built and time.monotonic() - self.checked_at < app.config['SEARCH_INDEX_CHECK']
+
+    def ensure_built(self):
+        if self.is_fresh():
+            return
+        with self.lock:
+            if self.is_fresh():
+                return
+            with db.engine.connect() as conn:
+                generation = read_generation(POSTS, conn)
+            if not self.built or generation != self.generation:
+                self.rebuild()
+            else:
+                self.checked_at = time.monotonic()
+
+    def rebuild(self):
+        with self.lock:
+            self.reset()
+            with db.engine.connect() as conn:
+                #read before the rows: a write during the load moves it again
+                generation = read_generation(POSTS, conn)
+                count = self.load(conn)
+            self.generation = generation
+            self.checked_at = time.monotonic()
+            self.built = True
+        return count
+
+
+BACKENDS = {'fts5': Fts5Backend, 'memory': InvertedIndex}
+_backend = {}
+
+
+def get_backend():
+    if 'instance' not in _backend:
+        name = app.config['SEARCH_BACKEND']
+        if name == 'auto':
+            name = 'fts5' if db.engine.dialect.name == 'sqlite' else 'memory'
+        cls = BACKENDS.get(name) or import_string(name)
+        _backend['instance'] = cls()
+    return _backend['instance']
+
+
+def search_posts(query, page=1, per_page=20):
+    terms = parse_query(query)
+    if not terms:
+        return []
+    matches = get_backend().search(terms, limit=per_page, offset=(page - 1) * per_page)
+    ids = [post_id for post_id, _ in matches]
+    posts = {post.id: post for post in db.session.scalars(select_post_cards().where(Post.id.in_(ids)))}
+    return [SearchHit(posts[post_id], highlight(snippet)) for post_id, snippet in matches if post_id in posts]
+
+
+#The in-process index follows committed changes; FTS5 has its own triggers
+@event.listens_for(so.Session, 'after_flush')
+def track_search_changes(session, flush_context):
+    if not isinstance(_backend.get('instance'), InvertedIndex):
+        return
+    changed = session.info.setdefault('search_changed', set())
+    deleted = session.info.setdefault('search_deleted', set())
+    for obj in session.new | session.dirty:
+        if isinstance(obj, Post):
+            changed.add(obj.id)
+    for obj in session.deleted:
+        if isinstance(obj, Post):
+            deleted.add(obj.id)
+
+
+@event.listens_for(so.Session, 'after_commit')
+def apply_search_changes(session):
+    index = _backend.get('instance')
+    changed = session.info.pop('search_changed', set())
+    deleted = session.info.pop('search_deleted', set())
+    if not isinstance(index, InvertedIndex) or not index.built:
+        return
+    for post_id in deleted:
+        index.remove(post_id)
+    changed -= deleted
+    if changed:
+        #the session can't run SQL inside after_commit, read on a fresh connection
+        with db.engine.connect() as conn:
+            index.load(conn, changed)
+
+
+@event.listens_for(so.Session, 'after_rollback')
+def discard_search_changes(session):
+    session.info.pop('search_changed', None)
+    session.info.pop('search_deleted', None)
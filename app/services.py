@@ -0,0 +1,93 @@
+import unicodedata
+import sqlalchemy as sa
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from app import db
+from app.models import Tag, SlugCounter
+
+
+def insert_ignore(model, dialect=None):
+    #INSERT that skips rows hitting a unique constraint instead of failing
+    dialect = dialect or db.session.get_bind().dialect.name
+    if dialect == 'sqlite':
+        return sqlite.insert(model).on_conflict_do_nothing()
+    if dialect == 'postgresql':
+        return postgresql.insert(model).on_conflict_do_nothing()
+    if dialect in ('mysql', 'mariadb'):
+        return sa.insert(model).prefix_with('IGNORE')
+    raise NotImplementedError(f'insert_ignore is not available for {dialect}')
+
+
+class TagService:
+    max_length = Tag.__table__.c.name.type.length
+
+    @classmethod
+    def normalize(cls, name):
+        #'  Python   tips ' -> 'Python tips'
+        name = unicodedata.normalize('NFC', name)
+        return ' '.join(name.split())[:cls.max_length]
+
+    @classmethod
+    def parse(cls, raw):
+        #'#python #flask tips' -> ['python', 'flask tips']
+        return [tag for tag in (cls.normalize(part) for part in (raw or '').split('#')) if tag]
+
+    @classmethod
+    def resolve_many(cls, names):
+        #one IN lookup, one INSERT for the missing ones, one reselect; returns
+        #Tag objects in the order given. Two requests creating the same new tag
+        #don't fail on tags.name: the loser's insert is a no-op and the reselect
+        #picks up the winner's row.
+        names = list(dict.fromkeys(tag for tag in (cls.normalize(name) for name in names) if tag))
+        if not names:
+            return []
+
+        tags = {tag.name: tag for tag in db.session.scalars(sa.select(Tag).where(Tag.name.in_(names)))}
+        missing = [name for name in names if name not in tags]
+        if missing:
+            db.session.execute(insert_ignore(Tag).values([{'name': name} for name in missing]))
+            tags.update(
+                (tag.name, tag) for tag in db.session.scalars(sa.select(Tag).where(Tag.name.in_(missing)))
+            )
+        return [tags[name] for name in names if name in tags]
+
+
+#Slug allocation
+#slug_counters holds every slug in use or retired, each with the last suffix
+#handed out for it as a base. One upsert per candidate both reserves it and
+#tells whether it was free (the returned counter is 1), so two posts with the
+#same title in the same second get my-post and my-post-2 without probing
+#posts. The -N candidates are reserved the same way, which keeps a title like
+#'My post 2' from taking a slug the counter hands out later, and vice versa.
+#The row stays locked until the transaction ends; a rollback frees the slug.
+def bump_slug_counter(connection, base):
+    table = SlugCounter.__table__
+    dialect = connection.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        insert = (sqlite if dialect == 'sqlite' else postgresql).insert(table).values(base=base, last=1)
+        return connection.execute(
+            insert.on_conflict_do_update(index_elements=[table.c.base], set_={'last': table.c.last + 1})
+            .returning(table.c.last)
+        ).scalar_one()
+    if dialect in ('mysql', 'mariadb'):
+        #no RETURNING: LAST_INSERT_ID(expr) stores the value for this connection
+        connection.execute(
+            mysql.insert(table).values(base=base, last=sa.func.last_insert_id(1))
+            .on_duplicate_key_update(last=sa.func.last_insert_id(table.c.last + 1))
+        )
+        return connection.execute(sa.select(sa.func.last_insert_id())).scalar_one()
+    raise NotImplementedError(f'slug allocation is not available for {dialect}')
+
+
+def allocate_slug(connection, base):
+    base = base or 'post'
+    last = bump_slug_counter(connection, base)
+    if last == 1:
+        return base
+    while bump_slug_counter(connection, f'{base}-{last}') != 1:
+        last = bump_slug_counter(connection, base)
+    return f'{base}-{last}'
+
+
+def reserve_slug(connection, slug):
+    #for slugs chosen elsewhere (imports, explicit values); posts.slug is unique anyway
+    connection.execute(insert_ignore(SlugCounter, connection.dialect.name).values(base=slug, last=1))
@@ -0,0 +1,121 @@
+from collections import Counter
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+from sqlalchemy import event
+from app import app, db
+from app.models import Post, Tag, Category, post_tags
+from app.pagination import keyset_page, keyset_query, make_page
+from app.queries import select_post_cards
+from app.services import TagService
+
+
+#Tag and category pages
+#tags.post_count and categories.post_count are denormalized. The session
+#tracks every post whose tags or category change (new, edited or deleted)
+#and applies the difference with relative UPDATEs right after the flush, in
+#the same transaction. Bulk Core writes (flask import, the benchmark data)
+#bypass this and call recount_post_counts() at the end.
+#post_tags.create_at copies the post's, so a tag page is a range scan in the
+#same (create_at, id) order as the archive; the ORM inserts post_tags rows
+#with the two ids only and the flush hook stamps them, Core writers fill it in.
+@event.listens_for(so.Session, 'before_flush')
+def track_deleted_posts(session, flush_context, instances):
+    #a deleted post's tags are gone after the flush, read them now
+    deleted = session.info.setdefault('post_counts_deleted', [])
+    for obj in session.deleted:
+        if isinstance(obj, Post):
+            deleted.append(([tag.id for tag in obj.tags], obj.category_id))
+
+
+@event.listens_for(so.Session, 'after_flush')
+def apply_post_counts(session, flush_context):
+    tags = Counter()
+    categories = Counter()
+    for obj in session.new:
+        if isinstance(obj, Post):
+            tags.update(tag.id for tag in obj.tags)
+            categories[obj.category_id] += 1
+    for obj in session.dirty:
+        if isinstance(obj, Post):
+            state = sa.inspect(obj)
+            history = state.attrs.tags.history
+            tags.update(tag.id for tag in history.added)
+            tags.subtract(tag.id for tag in history.deleted)
+            history = state.attrs.category_id.history
+            if history.has_changes():
+                categories.update(history.added)
+                categories.subtract(history.deleted)
+    for tag_ids, category_id in session.info.pop('post_counts_deleted', ()):
+        tags.subtract(tag_ids)
+        categories[category_id] -= 1
+
+    stamps = [{'b_post_id': obj.id, 'b_create_at': obj.create_at} for obj in session.new | session.dirty
+              if isinstance(obj, Post) and (obj in session.new or sa.inspect(obj).attrs.tags.history.added)]
+    if stamps:
+        session.connection().execute(
+            sa.update(post_tags)
+            .where(post_tags.c.post_id == sa.bindparam('b_post_id'), post_tags.c.create_at.is_(None))
+            .values(create_at=sa.bindparam('b_create_at')),
+            stamps
+        )
+
+    for model, deltas in ((Tag, tags), (Category, categories)):
+        params = [{'b_id': id, 'b_delta': delta} for id, delta in deltas.items() if id is not None and delta]
+        if params:
+            table = model.__table__
+            session.connection().execute(
+                sa.update(table).where(table.c.id == sa.bindparam('b_id'))
+                .values(post_count=table.c.post_count + sa.bindparam('b_delta')),
+                params
+            )
+
+
+@event.listens_for(so.Session, 'after_rollback')
+def discard_post_counts(session):
+    session.info.pop('post_counts_deleted', None)
+
+
+def recount_post_counts():
+    #resets both counters from post_tags and posts
+    db.session.execute(sa.text(
+        "UPDATE tags SET post_count = (SELECT count(*) FROM post_tags pt WHERE pt.tag_id = tags.id)"
+    ))
+    db.session.execute(sa.text(
+        "UPDATE categories SET post_count = (SELECT count(*) FROM posts p WHERE p.category_id = categories.id)"
+    ))
+    db.session.commit()
+
+
+def tag_page(tag, cursor=None, per_page=20):
+    #(create_at, id) cursor like the archive, on ix_post_tags_tag_id_create_at
+    #however big the tag is
+    ids = keyset_query(
+        sa.select(post_tags.c.post_id, post_tags.c.create_at).where(post_tags.c.tag_id == tag.id),
+        post_tags.c.create_at, post_tags.c.post_id, cursor=cursor, limit=per_page + 1
+    ).subquery()
+    posts = db.session.scalars(
+        select_post_cards().join(ids, ids.c.post_id == Post.id).order_by(ids.c.create_at.desc(), Post.id.desc())
+    ).all()
+    return make_page(posts, per_page)
+
+
+def category_page(category, cursor=None, per_page=20):
+    #(create_at, id) cursor like the archive, on ix_posts_category_id_create_at
+    return keyset_page(db.session, select_post_cards().where(Post.category_id == category.id),
+                       Post.create_at, Post.id, cursor=cursor, per_page=per_page)
+
+
+def suggest_tags(prefix, limit=None):
+    #case-insensitive name prefix as a range on ix_tags_name_lower (LIKE
+    #can't use an index on SQLite), most used tags first; both sides folded
+    #by the database's lower() so they agree
+    prefix = TagService.normalize(prefix)
+    if not prefix:
+        return []
+    folded = sa.func.lower(prefix)
+    return db.session.execute(
+        sa.select(Tag.name, Tag.post_count)
+        .where(sa.func.lower(Tag.name) >= folded, sa.func.lower(Tag.name) < folded + '\U0010ffff')
+        .order_by(Tag.post_count.desc(), Tag.name)
+        .limit(limit or app.config['TAG_SUGGESTIONS'])
+    ).all()
@@ -0,0 +1,161 @@
+import time
+import sqlalchemy as sa
+from app import app, db
+from app.models import Post, User, TimelineEntry, followers
+from app.pagination import keyset_query, make_page
+from app.queries import select_post_cards
+
+
+#Fan-out-on-write timeline
+#new_post copies the post id into every follower's timeline inside the same
+#transaction, so reading the feed is a single range scan on
+#(user_id, create_at). In 'hybrid' mode posts by authors with more than
+#TIMELINE_FANOUT_LIMIT followers are skipped on write and merged in at read
+#time. The choice is stored on the post (Post.fanned_out), so a post stays on
+#the read side when its author later drops below the limit, and moves only
+#when backfill() re-decides every post.
+
+_fan_in = {'ids': frozenset(), 'loaded_at': 0.0}
+FAN_IN_TTL = 60
+
+
+def timeline_enabled():
+    return app.config['FEED_MODE'] in ('timeline', 'hybrid')
+
+
+def hybrid_enabled():
+    return app.config['FEED_MODE'] == 'hybrid'
+
+
+def high_fanout_authors():
+    return frozenset(db.session.scalars(
+        sa.select(User.id).where(User.followers_count > app.config['TIMELINE_FANOUT_LIMIT'])
+    ).all())
+
+
+def fan_in_authors():
+    #authors with posts left out of the timelines, a small set read from
+    #ix_posts_fan_in_author_id_create_at at most once per FAN_IN_TTL per worker
+    if time.monotonic() - _fan_in['loaded_at'] > FAN_IN_TTL:
+        ids = db.session.scalars(sa.select(Post.author_id).where(Post.fanned_out == sa.false()).distinct()).all()
+        _fan_in['ids'] = frozenset(ids)
+        _fan_in['loaded_at'] = time.monotonic()
+    return _fan_in['ids']
+
+
+def is_high_fanout(user_id):
+    if not hybrid_enabled():
+        return False
+    count = db.session.scalar(sa.select(User.followers_count).where(User.id == user_id))
+    return (count or 0) > app.config['TIMELINE_FANOUT_LIMIT']
+
+
+def choose_delivery(post):
+    #before the post is flushed, so the choice is part of its INSERT; the
+    #follower count query mustn't autoflush it before fanned_out is set
+    with db.session.no_autoflush:
+        post.fanned_out = not is_high_fanout(post.author_id)
+
+
+def fan_out_post(post):
+    #post must be flushed (needs id and create_at); runs in the caller's transaction
+    post_id = sa.literal(post.id, sa.Integer)
+    create_at = sa.literal(post.create_at, sa.DateTime)
+    readers = sa.select(sa.literal(post.author_id, sa.Integer), post_id, create_at)
+    if post.fanned_out:
+        readers = sa.union(
+            readers,
+            sa.select(followers.c.follower_id, post_id, create_at).where(followers.c.followed_id == post.author_id)
+        )
+    db.session.execute(
+        sa.insert(TimelineEntry).from_select(['user_id', 'post_id', 'create_at'], readers)
+    )
+
+
+def remove_post(post):
+    db.session.execute(sa.delete(TimelineEntry).where(TimelineEntry.post_id == post.id))
+
+
+def on_follow(follower, followed):
+    #seed the timeline with the author's most recent posts; the ones that
+    #skipped fan-out are read at request time
+    recent = (
+        sa.select(sa.literal(follower.id, sa.Integer), Post.id, Post.create_at)
+        .where(Post.author_id == followed.id, Post.fanned_out == sa.true())
+        .order_by(Post.create_at.desc())
+        .limit(app.config['TIMELINE_FOLLOW_BACKFILL'])
+    )
+    db.session.execute(
+        sa.insert(TimelineEntry)
+        .from_select(['user_id', 'post_id', 'create_at'], recent)
+        .prefix_with('OR IGNORE', dialect='sqlite')
+    )
+
+
+def on_unfollow(follower, followed):
+    db.session.execute(
+        sa.delete(TimelineEntry).where(
+            TimelineEntry.user_id == follower.id,
+            TimelineEntry.post_id.in_(sa.select(Post.id).where(Post.author_id == followed.id))
+        )
+    )
+
+
+def timeline_feed(user, cursor=None, per_page=20):
+    stmt = (
+        select_post_cards()
+        .join(TimelineEntry, TimelineEntry.post_id == Post.id)
+        .where(TimelineEntry.user_id == user.id)
+    )
+    rows = db.session.scalars(
+        keyset_query(stmt, TimelineEntry.create_at, TimelineEntry.post_id, cursor=cursor, limit=per_page + 1)
+    ).all()
+
+    authors = fan_in_authors() if hybrid_enabled() else None
+    if authors:
+        followed = (
+            sa.select(followers.c.followed_id)
+            .where(followers.c.follower_id == user.id, followers.c.followed_id.in_(authors))
+        )
+        fanin = select_post_cards().where(Post.author_id.in_(followed), Post.fanned_out == sa.false())
+        rows = list(rows) + list(db.session.scalars(
+            keyset_query(fanin, Post.create_at, Post.id, cursor=cursor, limit=per_page + 1)
+        ))
+        rows = sorted(rows, key=lambda p: (p.create_at, p.id), reverse=True)
+
+    return make_page(rows, per_page)
+
+
+def backfill(chunk_size=500):
+    #re-decide fan-out for every post by its author's current follower count,
+    #then rebuild every timeline from the follow graph, one transaction per
+    #chunk of readers
+    skip = high_fanout_authors() if hybrid_enabled() else frozenset()
+    db.session.execute(
+        sa.update(Post).where(Post.fanned_out == sa.false()).values(fanned_out=True, update_at=Post.update_at)
+    )
+    if skip:
+        db.session.execute(
+            sa.update(Post).where(Post.author_id.in_(skip)).values(fanned_out=False, update_at=Post.update_at)
+        )
+    db.session.commit()
+    _fan_in['loaded_at'] = 0.0
+    user_ids = db.session.scalars(sa.select(User.id).order_by(User.id)).all()
+    total = 0
+    for start in range(0, len(user_ids), chunk_size):
+        chunk = user_ids[start:start + chunk_size]
+        db.session.execute(sa.delete(TimelineEntry).where(TimelineEntry.user_id.in_(chunk)))
+        followed_posts = (
+            sa.select(followers.c.follower_id, Post.id, Post.create_at)
+            .join(Post, Post.author_id == followers.c.followed_id)
+            .where(followers.c.follower_id.in_(chunk), Post.fanned_out == sa.true())
+        )
+        own_posts = sa.select(Post.author_id, Post.id, Post.create_at).where(Post.author_id.in_(chunk))
+        result = db.session.execute(
+            sa.insert(TimelineEntry).from_select(
+                ['user_id', 'post_id', 'create_at'], sa.union(followed_posts, own_posts)
+            )
+        )
+        db.session.commit()
+        total += result.rowcount
+    return total
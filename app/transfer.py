@@ -0,0 +1,382 @@
+import csv
+import itertools
+import json
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+from app import db
+from app.avatars import email_hash
+from app.models import (User, Post, Category, Tag, Role, SlugCounter, post_tags, user_roles, followers,
+                        make_slug)
+from app.services import TagService, insert_ignore, allocate_slug
+from app.taxonomy import recount_post_counts
+from app.reference import bump_generation
+from app.generations import bump_posts_generation
+
+
+#Bulk export/import of users, posts and the follow graph (`flask export`,
+#`flask import`), as NDJSON or CSV
+#Both directions stream: exports read with yield_per, imports pull records
+#from a generator in chunks and write each chunk with Core executemany
+#inserts in its own transaction, so memory stays flat whatever the file size.
+#Records refer to each other by natural keys (username, slug, category and
+#tag names), not ids. Imports bypass the ORM listeners, so the derived
+#columns (slug, excerpt, body_html, counts, email_hash) are computed here the
+#same way the listeners would.
+FORMATS = ('ndjson', 'csv')
+FIELDS = {
+    'users': ('username', 'email', 'password_hash', 'bio', 'roles'),
+    'posts': ('slug', 'title', 'body', 'author', 'category', 'tags', 'is_published',
+              'published_at', 'create_at', 'update_at'),
+    'follows': ('follower', 'followed'),
+}
+LIST_FIELDS = ('roles', 'tags')
+BOOL_FIELDS = ('is_published',)
+#password hashes are imported as they are; users without one can't log in
+#until they reset it (check_password_hash rejects this value)
+NO_PASSWORD = '!'
+
+
+#Reading and writing
+def guess_format(filename):
+    return 'csv' if filename.lower().endswith('.csv') else 'ndjson'
+
+
+def read_records(f, fmt):
+    if fmt == 'csv':
+        for row in csv.DictReader(f):
+            yield {key: decode_csv(key, value) for key, value in row.items()}
+    else:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def write_records(f, fmt, entity, records):
+    count = 0
+    if fmt == 'csv':
+        writer = csv.DictWriter(f, FIELDS[entity], lineterminator='\n')
+        writer.writeheader()
+        for record in records:
+            writer.writerow({key: encode_csv(value) for key, value in record.items()})
+            count += 1
+    else:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            count += 1
+    return count
+
+
+def encode_csv(value):
+    #lists use the post form's '#tag' syntax
+    if isinstance(value, list):
+        return ' '.join(f'#{item}' for item in value)
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return '' if value is None else value
+
+
+def decode_csv(key, value):
+    if key in LIST_FIELDS:
+        return TagService.parse(value)
+    if value == '':
+        return None
+    if key in BOOL_FIELDS:
+        return value.lower() in ('1', 'true', 'yes')
+    return value
+
+
+def isoformat(value):
+    return value.isoformat() if value else None
+
+
+def parse_datetime(value):
+    if not value:
+        return None
+    value = datetime.fromisoformat(value)
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def chunked(records, size):
+    records = iter(records)
+    while chunk := list(itertools.islice(records, size)):
+        yield chunk
+
+
+def stream(stmt, chunk_size):
+    return db.session.execute(stmt.execution_options(yield_per=chunk_size)).partitions()
+
+
+def group_names(stmt):
+    #(id, name) rows -> {id: [names]}
+    names = {}
+    for id, name in db.session.execute(stmt):
+        names.setdefault(id, []).append(name)
+    return names
+
+
+#Export
+def export_users(chunk_size=1000):
+    users = User.__table__
+    stmt = sa.select(users.c.id, users.c.username, users.c.email, users.c.password_hash, users.c.bio)
+    for rows in stream(stmt.order_by(users.c.id), chunk_size):
+        roles = group_names(
+            sa.select(user_roles.c.user_id, Role.name)
+            .join(Role, Role.id == user_roles.c.role_id)
+            .where(user_roles.c.user_id.in_([row.id for row in rows]))
+        )
+        for row in rows:
+            yield {'username': row.username, 'email': row.email, 'password_hash': row.password_hash,
+                   'bio': row.bio, 'roles': roles.get(row.id, [])}
+
+
+def export_posts(chunk_size=1000):
+    posts = Post.__table__
+    stmt = (
+        sa.select(posts.c.id, posts.c.slug, posts.c.title, posts.c.body, posts.c.is_published,
+                  posts.c.published_at, posts.c.create_at, posts.c.update_at,
+                  User.username.label('author'), Category.name.label('category'))
+        .join(User, User.id == posts.c.author_id)
+        .outerjoin(Category, Category.id == posts.c.category_id)
+        .order_by(posts.c.id)
+    )
+    for rows in stream(stmt, chunk_size):
+        tags = group_names(
+            sa.select(post_tags.c.post_id, Tag.name)
+            .join(Tag, Tag.id == post_tags.c.tag_id)
+            .where(post_tags.c.post_id.in_([row.id for row in rows]))
+        )
+        for row in rows:
+            yield {'slug': row.slug, 'title': row.title, 'body': row.body, 'author': row.author,
+                   'category': row.category, 'tags': tags.get(row.id, []),
+                   'is_published': bool(row.is_published), 'published_at': isoformat(row.published_at),
+                   'create_at': isoformat(row.create_at), 'update_at': isoformat(row.update_at)}
+
+
+def export_follows(chunk_size=1000):
+    follower = so.aliased(User)
+    followed = so.aliased(User)
+    stmt = (
+        sa.select(follower.username, followed.username)
+        .select_from(followers)
+        .join(follower, follower.id == followers.c.follower_id)
+        .join(followed, followed.id == followers.c.followed_id)
+        .order_by(followers.c.follower_id, followers.c.followed_id)
+    )
+    for rows in stream(stmt, chunk_size):
+        for follower_name, followed_name in rows:
+            yield {'follower': follower_name, 'followed': followed_name}
+
+
+EXPORTERS = {'users': export_users, 'posts': export_posts, 'follows': export_follows}
+
+
+#Import
+@contextmanager
+def deferred_indexes(*tables):
+    #drops the tables' non-unique indexes, and on SQLite their triggers, for
+    #the duration of the load and builds them once at the end; yields the
+    #names of the dropped triggers (the posts_fts ones mean the search index
+    #has to be rebuilt). Unique indexes stay, they are what dedupes the rows.
+    indexes = [index for table in tables for index in table.indexes if not index.unique]
+    triggers = []
+    if db.session.get_bind().dialect.name == 'sqlite':
+        triggers = db.session.execute(
+            sa.text("SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name IN :tables")
+            .bindparams(sa.bindparam('tables', expanding=True)),
+            {'tables': [table.name for table in tables]}
+        ).all()
+    for index in indexes:
+        db.session.execute(sa.schema.DropIndex(index, if_exists=True))
+    for name, _ in triggers:
+        db.session.execute(sa.text(f'DROP TRIGGER IF EXISTS {name}'))
+    db.session.commit()
+    try:
+        yield [name for name, _ in triggers]
+    finally:
+        db.session.rollback()
+        for index in indexes:
+            db.session.execute(sa.schema.CreateIndex(index, if_not_exists=True))
+        for _, sql in triggers:
+            db.session.execute(sa.text(sql))
+        db.session.commit()
+
+
+def user_ids(usernames):
+    #per chunk, the users table is too big to keep in memory
+    usernames = {name for name in usernames if name}
+    if not usernames:
+        return {}
+    return dict(db.session.execute(sa.select(User.username, User.id).where(User.username.in_(usernames))).all())
+
+
+def resolve_names(table, names, ids):
+    #name -> id map for small reference tables (tags, categories), kept in
+    #memory for the whole import; missing names are created
+    missing = {name for name in names if name and name not in ids}
+    if missing:
+        db.session.execute(insert_ignore(table), [{'name': name} for name in missing])
+        ids.update(db.session.execute(sa.select(table.c.name, table.c.id).where(table.c.name.in_(missing))).all())
+    return missing
+
+
+def allocate_slugs(chunk):
+    #a record's own slug is kept, and if it is already taken the post is
+    #assumed to be imported already (re-running an import is a no-op). Slugs
+    #made from the title go through the allocator only when they collide, the
+    #rest are reserved with one insert. Returns a slug or None per record.
+    counters = SlugCounter.__table__
+    wanted = [(record.get('slug') or make_slug(record['title']) or 'post', bool(record.get('slug')))
+              for record in chunk]
+    taken = set(db.session.scalars(
+        sa.select(counters.c.base).where(counters.c.base.in_({slug for slug, _ in wanted}))
+    ))
+    slugs = []
+    pending = []
+    for slug, explicit in wanted:
+        if slug in taken:
+            if explicit:
+                slugs.append(None)
+                continue
+            #the allocator has to see this chunk's earlier slugs
+            reserve_slugs(pending)
+            slug = allocate_slug(db.session.connection(), slug)
+        else:
+            pending.append(slug)
+        taken.add(slug)
+        slugs.append(slug)
+    reserve_slugs(pending)
+    return slugs
+
+
+def reserve_slugs(slugs):
+    if slugs:
+        db.session.execute(insert_ignore(SlugCounter.__table__), [{'base': slug, 'last': 1} for slug in slugs])
+        slugs.clear()
+
+
+def import_users(records, chunk_size=1000):
+    users = User.__table__
+    role_ids = dict(db.session.execute(sa.select(Role.name, Role.id)).all())
+    imported = skipped = 0
+    for chunk in chunked(records, chunk_size):
+        existing = user_ids(record.get('username') for record in chunk)
+        rows = {}
+        for record in chunk:
+            username, email = record.get('username'), record.get('email')
+            if not username or not email or username in existing or username in rows:
+                skipped += 1
+                continue
+            rows[username] = {'username': username, 'email': email, 'email_hash': email_hash(email),
+                              'password_hash': record.get('password_hash') or NO_PASSWORD,
+                              'bio': record.get('bio')}
+        if rows:
+            #a taken email is skipped by the insert and so missing from the reselect
+            db.session.execute(insert_ignore(users), list(rows.values()))
+            ids = user_ids(rows)
+            skipped += len(rows) - len(ids)
+            imported += len(ids)
+            roles = [{'user_id': ids[record['username']], 'role_id': role_ids[name]}
+                     for record in chunk if record.get('username') in ids
+                     for name in record.get('roles') or () if name in role_ids]
+            if roles:
+                db.session.execute(insert_ignore(user_roles), roles)
+        db.session.commit()
+    return imported, skipped
+
+
+def import_follows(records, chunk_size=1000):
+    imported = skipped = 0
+    for chunk in chunked(records, chunk_size):
+        ids = user_ids(itertools.chain.from_iterable((r.get('follower'), r.get('followed')) for r in chunk))
+        rows = {(ids[record['follower']], ids[record['followed']])
+                for record in chunk
+                if record.get('follower') in ids and record.get('followed') in ids
+                and record['follower'] != record['followed']}
+        skipped += len(chunk) - len(rows)
+        if rows:
+            result = db.session.execute(insert_ignore(followers),
+                                        [{'follower_id': a, 'followed_id': b} for a, b in rows])
+            imported += result.rowcount
+            skipped += len(rows) - result.rowcount
+        db.session.commit()
+    recount_follows()
+    return imported, skipped
+
+
+def import_posts(records, chunk_size=1000):
+    posts = Post.__table__
+    category_ids = dict(db.session.execute(sa.select(Category.name, Category.id)).all())
+    tag_ids = dict(db.session.execute(sa.select(Tag.name, Tag.id)).all())
+    imported = skipped = 0
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    for chunk in chunked(records, chunk_size):
+        valid = [record for record in chunk if record.get('title') and record.get('body') and record.get('author')]
+        authors = user_ids(record['author'] for record in valid)
+        valid = [record for record in valid if record['author'] in authors]
+        for record in valid:
+            record['tags'] = [TagService.normalize(name) for name in record.get('tags') or ()]
+        if resolve_names(Category.__table__, {record.get('category') for record in valid}, category_ids):
+            #new categories, the cached post form choices are stale
+            bump_generation()
+        resolve_names(Tag.__table__, {name for record in valid for name in record['tags']}, tag_ids)
+
+        rows = []
+        tags = {}
+        for record, slug in zip(valid, allocate_slugs(valid)):
+            if slug is None:
+                continue
+            #the same fields the before_insert listeners fill in
+            fields = Post(body=record['body'])
+            fields.refresh_body_fields()
+            create_at = parse_datetime(record.get('create_at')) or now
+            rows.append({
+                'title': record['title'],
+                'slug': slug,
+                'body': record['body'],
+                'excerpt': fields.excerpt,
+                'body_html': fields.body_html,
+                'word_count': fields.word_count,
+                'reading_time': fields.reading_time,
+                'create_at': create_at,
+                'update_at': parse_datetime(record.get('update_at')) or create_at,
+                'published_at': parse_datetime(record.get('published_at')),
+                'is_published': bool(record.get('is_published')),
+                'author_id': authors[record['author']],
+                'category_id': category_ids.get(record.get('category')),
+            })
+            tags[slug] = {tag_ids[name] for name in record['tags'] if name in tag_ids}
+        skipped += len(chunk) - len(rows)
+        if rows:
+            db.session.execute(sa.insert(posts), rows)
+            post_ids = {slug: (id, create_at) for slug, id, create_at in db.session.execute(
+                sa.select(posts.c.slug, posts.c.id, posts.c.create_at).where(posts.c.slug.in_(tags))
+            )}
+            links = [{'post_id': post_ids[slug][0], 'tag_id': tag_id, 'create_at': post_ids[slug][1]}
+                     for slug, ids in tags.items() for tag_id in ids]
+            if links:
+                db.session.execute(sa.insert(post_tags), links)
+            bump_posts_generation()
+            imported += len(rows)
+        db.session.commit()
+    recount_post_counts()
+    return imported, skipped
+
+
+IMPORTERS = {'users': import_users, 'posts': import_posts, 'follows': import_follows}
+#tables whose secondary indexes are deferred while importing each entity
+IMPORT_TABLES = {'users': (User.__table__,), 'posts': (Post.__table__, post_tags), 'follows': (followers,)}
+
+
+def recount_follows():
+    #resets the denormalized follow counters from the followers table
+    result = db.session.execute(sa.text(
+        "UPDATE users SET "
+        "followers_count = (SELECT count(*) FROM followers f WHERE f.followed_id = users.id), "
+        "following_count = (SELECT count(*) FROM followers f WHERE f.follower_id = users.id)"
+    ))
+    db.session.commit()
+    return result.rowcount
@@ -0,0 +1,304 @@
+"""Benchmarks for the core routes.
+
+    python benchmarks/bench.py run --output results.json
+    python benchmarks/bench.py run --http --concurrency 16 --duration 10
+    python benchmarks/bench.py compare baseline.json results.json --threshold 0.1
+
+`run` builds a fresh SQLite database (unless --database is given), migrates
+it, fills it with benchmarks/datagen.py and times every scenario, either in
+process through the Flask test client or over HTTP against a local threaded
+server. Queries per request come from the SQL profiler's Server-Timing header.
+`compare` exits with status 1 when a scenario got slower than the threshold
+or issues more queries than before, so it can gate a CI job.
+"""
+import argparse
+import http.client
+import itertools
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+QUERIES_RE = re.compile(r'desc="(\d+) queries"')
+
+
+def percentile(sorted_values, p):
+    #nearest rank
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, max(0, round(p / 100 * len(sorted_values)) - 1))]
+
+
+def summarize(latencies, queries, errors, elapsed):
+    latencies = sorted(latencies)
+    count = len(latencies)
+    return {
+        'requests': count,
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'mean_ms': round(sum(latencies) / count * 1000, 3) if count else 0.0,
+        'throughput_rps': round(count / elapsed, 1) if elapsed else 0.0,
+        'queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+        'max_queries': max(queries) if queries else None,
+    }
+
+
+def scenarios(dataset, rng):
+    #name -> function returning (method, path, form data); new_post titles are unique
+    users, posts = dataset['users'], dataset['posts']
+    counter = itertools.count()
+    return {
+        'home': lambda: ('GET', '/home', None),
+        'read_all_posts': lambda: ('GET', '/posts', None),
+        'read_post': lambda: ('GET', f'/post/bench-post-{rng.randrange(posts)}', None),
+        'profile': lambda: ('GET', f'/profile/user{rng.randrange(users)}', None),
+        'profile_celebrity': lambda: ('GET', '/profile/user0', None),
+        'notifications': lambda: ('GET', '/notifications', None),
+        'search': lambda: ('GET', '/search?q=flask+cache', None),
+        'new_post': lambda: ('POST', '/post/new', {
+            'title': f'Benchmark {next(counter)} {rng.random()}',
+            'body': 'Written by the benchmark. ' * 40,
+            'category_id': 1,
+            'tags': '#tag0 #tag1 #benchmark',
+        }),
+    }
+
+
+def run_test_client(app, requests, warmup, dataset, names, rng):
+    client = app.test_client()
+    client.post('/login', data={'username': 'user1', 'password': 'bench'})
+    results = {}
+    for name, make_request in scenarios(dataset, rng).items():
+        if names and name not in names:
+            continue
+        latencies, queries, errors = [], [], 0
+        started = time.perf_counter()
+        for i in range(warmup + requests):
+            method, path, data = make_request()
+            t0 = time.perf_counter()
+            response = client.open(path, method=method, data=data)
+            elapsed = time.perf_counter() - t0
+            if i < warmup:
+                continue
+            if response.status_code >= 400:
+                errors += 1
+            latencies.append(elapsed)
+            match = QUERIES_RE.search(response.headers.get('Server-Timing', ''))
+            if match:
+                queries.append(int(match.group(1)))
+            if i == warmup - 1:
+                started = time.perf_counter()
+        results[name] = summarize(latencies, queries, errors, time.perf_counter() - started)
+    return results
+
+
+class HttpUser:
+    #a logged-in client: a new connection per request, the session cookie kept
+    def __init__(self, port, username):
+        self.port = port
+        self.cookies = SimpleCookie()
+        self.request('POST', '/login', {'username': username, 'password': 'bench'})
+
+    def request(self, method, path, data=None):
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+        headers = {}
+        body = None
+        if data is not None:
+            body = urlencode(data)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{key}={morsel.value}' for key, morsel in self.cookies.items())
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            for cookie in response.headers.get_all('Set-Cookie') or ():
+                self.cookies.load(cookie)
+            return response.status, response.headers.get('Server-Timing', '')
+        finally:
+            conn.close()
+
+
+def run_http(app, concurrency, duration, dataset, names, rng):
+    from werkzeug.serving import make_server
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        users = [HttpUser(server.server_port, f'user{1 + i % (dataset["users"] - 1)}') for i in range(concurrency)]
+        results = {}
+        for name, make_request in scenarios(dataset, rng).items():
+            if names and name not in names:
+                continue
+            latencies, queries, errors = [], [], [0]
+            lock = threading.Lock()
+            deadline = time.perf_counter() + duration
+
+            def worker(user):
+                while time.perf_counter() < deadline:
+                    with lock:
+                        method, path, data = make_request()
+                    t0 = time.perf_counter()
+                    try:
+                        status, timing = user.request(method, path, data)
+                    except OSError:
+                        status, timing = 599, ''
+                    elapsed = time.perf_counter() - t0
+                    match = QUERIES_RE.search(timing)
+                    with lock:
+                        latencies.append(elapsed)
+                        errors[0] += status >= 400
+                        if match:
+                            queries.append(int(match.group(1)))
+
+            started = time.perf_counter()
+            threads = [threading.Thread(target=worker, args=(user,)) for user in users]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            results[name] = summarize(latencies, queries, errors[0], time.perf_counter() - started)
+            results[name]['concurrency'] = concurrency
+        return results
+    finally:
+        server.shutdown()
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    if args.database is None:
+        args.database = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='blog-bench-'), 'bench.db')
+    #the app reads its configuration on import
+    os.environ['DATABASE_URL'] = args.database
+    os.environ['SQL_PROFILER'] = '1'
+    os.environ.setdefault('APP_CONFIG', 'Development')
+    if args.jobs_mode:
+        os.environ['JOBS_MODE'] = args.jobs_mode
+    if args.feed_mode:
+        os.environ['FEED_MODE'] = args.feed_mode
+    sys.path.insert(0, ROOT)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    import logging
+    from flask_migrate import upgrade
+    from app import app
+    import datagen
+
+    app.config.update(WTF_CSRF_ENABLED=False, SQL_STATEMENT_BUDGET=None)
+    app.logger.setLevel(logging.WARNING)
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+    with app.app_context():
+        started = time.perf_counter()
+        upgrade(directory=os.path.join(ROOT, 'migrations'))
+        dataset = datagen.generate(users=args.users, posts=args.posts, tags=args.tags,
+                                   follows_per_user=args.follows, notifications=args.notifications,
+                                   seed=args.seed)
+        dataset['seconds'] = round(time.perf_counter() - started, 2)
+    print(f'data set ready in {dataset["seconds"]} s: {dataset}', file=sys.stderr)
+
+    rng = random.Random(args.seed)
+    names = set(args.scenario or ())
+    report = {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'config': os.environ['APP_CONFIG'],
+            'feed_mode': app.config['FEED_MODE'],
+            'jobs_mode': app.config['JOBS_MODE'],
+            'database': app.config['SQLALCHEMY_DATABASE_URI'],
+            'dataset': dataset,
+        },
+        'test_client': run_test_client(app, args.requests, args.warmup, dataset, names, rng),
+    }
+    if args.http:
+        report['http'] = run_http(app, args.concurrency, args.duration, dataset, names, rng)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    print(output)
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    regressions = []
+    for mode in ('test_client', 'http'):
+        for name, now in current.get(mode, {}).items():
+            before = baseline.get(mode, {}).get(name)
+            if before is None:
+                continue
+            change = now[args.metric] / before[args.metric] - 1 if before[args.metric] else 0.0
+            line = f'{mode:12} {name:18} {args.metric} {before[args.metric]:>10} -> {now[args.metric]:>10} ({change:+.1%})'
+            if change > args.threshold:
+                regressions.append(line)
+            if (now['queries_per_request'] or 0) > (before['queries_per_request'] or 0):
+                regressions.append(f'{mode:12} {name:18} queries/request '
+                                   f'{before["queries_per_request"]} -> {now["queries_per_request"]}')
+            print(line)
+    if regressions:
+        print('\nRegressions:', *regressions, sep='\n')
+        return 1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='build a data set and time the routes')
+    run_parser.add_argument('--database', help='database URL, default: a new SQLite file in a temp dir')
+    run_parser.add_argument('--users', type=int, default=1000)
+    run_parser.add_argument('--posts', type=int, default=5000)
+    run_parser.add_argument('--tags', type=int, default=50)
+    run_parser.add_argument('--follows', type=int, default=20, help='mean follows per user')
+    run_parser.add_argument('--notifications', type=int, default=20000)
+    run_parser.add_argument('--seed', type=int, default=42)
+    run_parser.add_argument('--requests', type=int, default=200, help='test client requests per scenario')
+    run_parser.add_argument('--warmup', type=int, default=20)
+    run_parser.add_argument('--http', action='store_true', help='also load a local server over HTTP')
+    run_parser.add_argument('--concurrency', type=int, default=8)
+    run_parser.add_argument('--duration', type=float, default=5.0, help='seconds per scenario over HTTP')
+    run_parser.add_argument('--scenario', action='append', help='only run this scenario (repeatable)')
+    run_parser.add_argument('--jobs-mode', choices=('eager', 'thread', 'queue'))
+    run_parser.add_argument('--feed-mode', choices=('fanin', 'timeline', 'hybrid'))
+    run_parser.add_argument('--output', help='write the JSON report here too')
+
+    compare_parser = commands.add_parser('compare', help='fail if a run regressed against a baseline')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--metric', default='p95_ms', choices=('p50_ms', 'p95_ms', 'p99_ms', 'mean_ms'))
+    compare_parser.add_argument('--threshold', type=float, default=0.1, help='allowed slowdown, 0.1 = 10%%')
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        run(args)
+    else:
+        sys.exit(compare(args))
+
+
+if __name__ == '__main__':
+    main()
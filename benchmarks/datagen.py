@@ -0,0 +1,135 @@
+import bisect
+import itertools
+import math
+import random
+from datetime import datetime, timedelta, timezone
+import sqlalchemy as sa
+from werkzeug.security import generate_password_hash
+from app import db, timeline
+from app.avatars import email_hash
+from app.models import (User, Post, Category, Tag, Notification, SlugCounter, post_tags, followers,
+                        make_excerpt, WORDS_PER_MINUTE)
+from app.rendering import render_markdown
+from app.taxonomy import recount_post_counts
+from app.reference import bump_generation
+from app.generations import bump_posts_generation
+
+
+#Synthetic data set for the benchmarks
+#Follows and authorship are drawn from a Zipf distribution, so a handful of
+#users have most of the followers and posts, as on a real site: the feed and
+#fan-out paths see both celebrities and long-tail users. Everything is written
+#with bulk Core inserts; the ORM listeners are bypassed, so the derived
+#columns (excerpt, body_html, counters) are filled in here.
+PASSWORD = 'bench'
+WORDS = ('flask sqlalchemy python query index cache latency feed post tag user follow '
+         'notification worker queue template render markdown session engine replica '
+         'benchmark profile request response database migration search timeline').split()
+CHUNK = 1000
+
+
+class Zipf:
+    #weights 1/rank**s over 0..n-1, sampled with a binary search on the cumulative sum
+    def __init__(self, n, s, rng):
+        self.rng = rng
+        self.cumulative = list(itertools.accumulate(1 / (rank + 1) ** s for rank in range(n)))
+
+    def sample(self):
+        return bisect.bisect(self.cumulative, self.rng.random() * self.cumulative[-1])
+
+
+def insert_chunks(table, rows):
+    for start in range(0, len(rows), CHUNK):
+        db.session.execute(sa.insert(table), rows[start:start + CHUNK])
+
+
+def sentence(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def generate(users=1000, posts=5000, tags=50, categories=10, follows_per_user=20,
+             notifications=20000, skew=1.1, seed=42):
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+
+    insert_chunks(Category.__table__, [{'name': f'Category {i}', 'description': sentence(rng, 8)}
+                                       for i in range(categories)])
+    bump_generation()
+    insert_chunks(Tag.__table__, [{'name': f'tag{i}'} for i in range(tags)])
+
+    #one password hash for everybody, hashing is deliberately slow
+    password_hash = generate_password_hash(PASSWORD)
+    insert_chunks(User.__table__, [{
+        'username': f'user{i}',
+        'email': f'user{i}@bench.local',
+        'email_hash': email_hash(f'user{i}@bench.local'),
+        'password_hash': password_hash,
+        'bio': sentence(rng, 12),
+    } for i in range(users)])
+    user_ids = db.session.scalars(sa.select(User.id).order_by(User.id)).all()
+
+    popular = Zipf(users, skew, rng)
+    edges = set()
+    for follower in user_ids:
+        for _ in range(max(1, int(rng.expovariate(1 / follows_per_user)))):
+            followed = user_ids[popular.sample()]
+            if followed != follower:
+                edges.add((follower, followed))
+    insert_chunks(followers, [{'follower_id': a, 'followed_id': b} for a, b in edges])
+
+    category_ids = db.session.scalars(sa.select(Category.id)).all()
+    tag_ids = db.session.scalars(sa.select(Tag.id).order_by(Tag.id)).all()
+    tag_popularity = Zipf(tags, skew, rng)
+    post_rows = []
+    for i in range(posts):
+        body = '\n\n'.join(sentence(rng, rng.randint(20, 80)) for _ in range(rng.randint(1, 6)))
+        created = now - timedelta(seconds=rng.randint(0, 90 * 24 * 3600))
+        word_count = len(body.split())
+        post_rows.append({
+            'title': f'Post {i}: {sentence(rng, 4)}',
+            'slug': f'bench-post-{i}',
+            'body': body,
+            'excerpt': make_excerpt(body),
+            'body_html': render_markdown(body),
+            'word_count': word_count,
+            'reading_time': max(1, math.ceil(word_count / WORDS_PER_MINUTE)),
+            'create_at': created,
+            'update_at': created,
+            'is_published': True,
+            'author_id': user_ids[popular.sample()],
+            'category_id': rng.choice(category_ids),
+        })
+    insert_chunks(Post.__table__, post_rows)
+    bump_posts_generation()
+    insert_chunks(SlugCounter.__table__, [{'base': row['slug'], 'last': 1} for row in post_rows])
+    posts_by_id = db.session.execute(sa.select(Post.id, Post.author_id, Post.create_at)).all()
+
+    insert_chunks(post_tags, [{'post_id': post.id, 'tag_id': tag_id, 'create_at': post.create_at}
+                              for post in posts_by_id
+                              for tag_id in {tag_ids[tag_popularity.sample()] for _ in range(rng.randint(0, 4))}])
+
+    #distinct (user_id, post_id) pairs, notifications are unique per post
+    notifications = min(notifications, len(user_ids) * len(posts_by_id))
+    pairs = (divmod(k, len(posts_by_id)) for k in rng.sample(range(len(user_ids) * len(posts_by_id)), notifications))
+    insert_chunks(Notification.__table__, [{
+        'user_id': user_ids[user],
+        'post_id': posts_by_id[post].id,
+        'message': f'New post: Post {posts_by_id[post].id}',
+        'is_read': rng.random() < 0.7,
+        'timestamp': posts_by_id[post].create_at,
+    } for user, post in pairs])
+
+    #the denormalized counters, same statements as the migrations' backfills
+    db.session.execute(sa.text(
+        "UPDATE users SET "
+        "followers_count = (SELECT count(*) FROM followers f WHERE f.followed_id = users.id), "
+        "following_count = (SELECT count(*) FROM followers f WHERE f.follower_id = users.id), "
+        "unread_notifications = (SELECT count(*) FROM notifications n WHERE n.user_id = users.id AND n.is_read = 0)"
+    ))
+    db.session.commit()
+    recount_post_counts()
+    if timeline.timeline_enabled():
+        timeline.backfill()
+
+    return {'users': users, 'follows': len(edges), 'posts': posts, 'tags': tags,
+            'categories': categories, 'notifications': notifications, 'seed': seed}
@@ -1,7 +1,15 @@
 from app import app, db
+import click
 import sqlalchemy as sa
 import sqlalchemy.orm as so
-from app.models import Role
+from app.models import Role, Post
+from app import timeline
+from app.search import get_backend, InvertedIndex
+from app.jobs import run_worker
+from app.fragments import get_fragment_cache
+from app import transfer
+from app import taxonomy
+from app.generations import bump_posts_generation
 
 @app.shell_context_processor
 def make_shell_context():
@@ -17,4 +25,129 @@ def seed_roles():
             role = Role(name=role_name, description=f'{role_name} role')
             db.session.add(role)
     db.session.commit()
-    print('Roles added successfully.')
\ No newline at end of file
+    print('Roles added successfully.')
+
+
+@app.cli.command('backfill_timeline')
+def backfill_timeline():
+    #rebuild timeline_entries, run after switching FEED_MODE to 'timeline' or 'hybrid'
+    total = timeline.backfill()
+    print(f'Timeline entries written: {total}.')
+
+
+@app.cli.command('backfill_post_fields')
+@click.option('--all', 'recompute_all', is_flag=True, help='Recompute every post, not only the ones missing body_html.')
+@click.option('--chunk-size', default=500, show_default=True)
+def backfill_post_fields(recompute_all, chunk_size):
+    #fills excerpt/body_html/word_count/reading_time in chunks, keyed on id,
+    #without touching update_at or firing the ORM listeners row by row
+    posts = Post.__table__
+    update = (
+        sa.update(posts)
+        .where(posts.c.id == sa.bindparam('b_id'))
+        .values(excerpt=sa.bindparam('b_excerpt'),
+                body_html=sa.bindparam('b_body_html'),
+                word_count=sa.bindparam('b_word_count'),
+                reading_time=sa.bindparam('b_reading_time'),
+                update_at=posts.c.update_at)
+    )
+    last_id = 0
+    total = 0
+    while True:
+        stmt = sa.select(posts.c.id, posts.c.body).where(posts.c.id > last_id).order_by(posts.c.id).limit(chunk_size)
+        if not recompute_all:
+            stmt = stmt.where(posts.c.body_html.is_(None))
+        rows = db.session.execute(stmt).all()
+        if not rows:
+            break
+        params = []
+        for id, body in rows:
+            post = Post(body=body)
+            post.refresh_body_fields()
+            params.append({'b_id': id, 'b_excerpt': post.excerpt, 'b_body_html': post.body_html,
+                           'b_word_count': post.word_count, 'b_reading_time': post.reading_time})
+        db.session.execute(update, params)
+        #excerpts and reading times show on the archive
+        bump_posts_generation()
+        db.session.commit()
+        last_id = rows[-1].id
+        total += len(rows)
+    print(f'Post fields updated: {total}.')
+
+
+@app.cli.command('recount_follows')
+def recount_follows():
+    #resets the denormalized follow counters from the followers table
+    total = transfer.recount_follows()
+    print(f'Follow counts recomputed for {total} users.')
+
+
+@app.cli.command('recount_post_counts')
+def recount_post_counts():
+    #resets tags.post_count and categories.post_count
+    taxonomy.recount_post_counts()
+    print('Tag and category post counts recomputed.')
+
+
+@app.cli.command('export')
+@click.argument('entity', type=click.Choice(tuple(transfer.EXPORTERS)))
+@click.argument('output', type=click.File('w', encoding='utf-8'), default='-')
+@click.option('--format', 'fmt', type=click.Choice(transfer.FORMATS), help='Defaults to csv for *.csv files, else ndjson.')
+@click.option('--chunk-size', default=1000, show_default=True)
+def export_command(entity, output, fmt, chunk_size):
+    #streams users, posts or follows to a file ('-' is stdout)
+    fmt = fmt or transfer.guess_format(output.name)
+    total = transfer.write_records(output, fmt, entity, transfer.EXPORTERS[entity](chunk_size))
+    click.echo(f'Exported {total} {entity}.', err=True)
+
+
+@app.cli.command('import')
+@click.argument('entity', type=click.Choice(tuple(transfer.IMPORTERS)))
+@click.argument('input', type=click.File('r', encoding='utf-8'), default='-')
+@click.option('--format', 'fmt', type=click.Choice(transfer.FORMATS), help='Defaults to csv for *.csv files, else ndjson.')
+@click.option('--chunk-size', default=1000, show_default=True, help='Rows per transaction.')
+@click.option('--defer-indexes/--keep-indexes', default=True, show_default=True,
+              help='Drop secondary indexes and triggers during the load and rebuild them once at the end.')
+def import_command(entity, input, fmt, chunk_size, defer_indexes):
+    #users first: posts and follows refer to them by username
+    records = transfer.read_records(input, fmt or transfer.guess_format(input.name))
+    importer = transfer.IMPORTERS[entity]
+    if defer_indexes:
+        with transfer.deferred_indexes(*transfer.IMPORT_TABLES[entity]) as triggers:
+            imported, skipped = importer(records, chunk_size)
+        if triggers:
+            #the FTS triggers were off during the load
+            print(f'Search index ({get_backend().name}) rebuilt: {get_backend().rebuild()} posts.')
+    else:
+        imported, skipped = importer(records, chunk_size)
+    print(f'Imported {imported} {entity}, skipped {skipped}.')
+    if entity in ('posts', 'follows') and timeline.timeline_enabled():
+        print(f'Timeline entries written: {timeline.backfill()}.')
+
+
+@app.cli.command('rebuild_search_index')
+def rebuild_search_index():
+    backend = get_backend()
+    if isinstance(backend, InvertedIndex):
+        #each worker holds its own copy; moving the generation makes them reload
+        bump_posts_generation()
+        db.session.commit()
+    total = backend.rebuild()
+    print(f'Search index ({backend.name}) rebuilt: {total} posts.')
+
+
+@app.cli.command('clear_fragment_cache')
+def clear_fragment_cache():
+    cache = get_fragment_cache()
+    if cache is not None:
+        cache.clear()
+    print('Fragment cache cleared.')
+
+
+@app.cli.command('run-worker')
+@click.option('--concurrency', type=int, help='Worker processes, defaults to JOB_WORKERS.')
+@click.option('--poll-interval', type=float, help='Seconds between polls when idle.')
+@click.option('--once', is_flag=True, help='Exit when no job is ready instead of polling.')
+def run_worker_command(concurrency, poll_interval, once):
+    processed = run_worker(concurrency=concurrency, poll_interval=poll_interval, once=once)
+    print(f'Jobs processed: {processed}.')
@@ -4,12 +4,125 @@ basedir = os.path.abspath(os.path.dirname(__file__))
 
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or "default_guess"
+    POSTS_PER_PAGE = int(os.environ.get('POSTS_PER_PAGE') or 20)
+    #/posts archive: page size and whether to stream the rendered template
+    ARCHIVE_PER_PAGE = int(os.environ.get('ARCHIVE_PER_PAGE') or 50)
+    STREAM_ARCHIVE = os.environ.get('STREAM_ARCHIVE') == '1'
+    #in-process cache of rendered Markdown, bounded by bytes of html
+    MARKDOWN_CACHE_BYTES = int(os.environ.get('MARKDOWN_CACHE_BYTES') or 16 * 1024 * 1024)
+    #rendered post cards, see app/fragments.py: 'memory' (per worker), 'sqlite'
+    #(one file shared by the workers on a host) or empty to disable
+    FRAGMENT_CACHE = os.environ.get('FRAGMENT_CACHE', 'memory') or None
+    FRAGMENT_CACHE_BYTES = 8 * 1024 * 1024
+    FRAGMENT_CACHE_PATH = os.environ.get('FRAGMENT_CACHE_PATH') or os.path.join(basedir, 'fragments.db')
+    FRAGMENT_CACHE_ENTRIES = 50000
+    #avatar images, see app/avatars.py: 'gravatar' or 'local' (identicons served
+    #from AVATAR_CACHE_DIR); run `flask clear_fragment_cache` after switching
+    AVATAR_SOURCE = os.environ.get('AVATAR_SOURCE') or 'gravatar'
+    AVATAR_SIZES = (32, 64, 128, 256)
+    AVATAR_CACHE_DIR = os.environ.get('AVATAR_CACHE_DIR') or os.path.join(basedir, 'avatars')
+    #files kept in AVATAR_CACHE_DIR (users x sizes); past it avatars are rendered per request
+    AVATAR_CACHE_FILES = 20000
+    AVATAR_MAX_AGE = 365 * 24 * 3600
+    #'auto' uses the FTS5 index on SQLite and the in-process index elsewhere
+    SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND') or 'auto'
+    SEARCH_PER_PAGE = 20
+    SEARCH_MAX_PAGE = 50
+    #seconds between the in-process index's checks for writes by other processes
+    SEARCH_INDEX_CHECK = 5
+    #/tag/<name> and /category/<id> pages, and the post form's tag suggestions
+    BROWSE_PER_PAGE = 30
+    TAG_SUGGESTIONS = 10
+    #background jobs, see app/jobs.py: 'queue' (flask run-worker), 'thread' or 'eager'
+    JOBS_MODE = os.environ.get('JOBS_MODE') or 'thread'
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS') or 2)
+    JOB_MAX_ATTEMPTS = 5
+    JOB_BACKOFF_BASE = 2
+    JOB_BACKOFF_MAX = 300
+    JOB_TIMEOUT = 600
+    JOB_POLL_INTERVAL = 1.0
+    NOTIFICATION_CHUNK_SIZE = 1000
+    NOTIFICATIONS_PER_PAGE = 30
+    #live notifications (Server-Sent Events), see app/events.py
+    SSE_MAX_STREAMS = int(os.environ.get('SSE_MAX_STREAMS') or 100)
+    #open tabs per user; a new one closes the oldest stream
+    SSE_STREAMS_PER_USER = 3
+    SSE_BUFFER_SIZE = 50
+    SSE_KEEPALIVE = 15
+    SSE_MAX_DURATION = 300
+    SSE_RETRY_MS = 5000
+    #per-worker cache of current_user snapshots (id, names, role names)
+    USER_CACHE_SIZE = 10000
+    USER_CACHE_TTL = 60
+    #per-worker snapshot of categories and roles, see app/reference.py; other
+    #workers' changes are picked up within this many seconds
+    REFERENCE_CACHE_TTL = 5
+    #home feed source: 'fanin' (query followed authors), 'timeline' (fan-out on write)
+    #or 'hybrid' (fan-out on write, fan-in for authors above TIMELINE_FANOUT_LIMIT)
+    FEED_MODE = os.environ.get('FEED_MODE') or 'fanin'
+    TIMELINE_FANOUT_LIMIT = int(os.environ.get('TIMELINE_FANOUT_LIMIT') or 10000)
+    TIMELINE_FOLLOW_BACKFILL = 50
+    #engine profile, see app/database.py. Pragmas run on every new SQLite
+    #connection; cache_size is in KiB when negative
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'cache_size': -16000,
+        'mmap_size': 64 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+    }
+    #pool_pre_ping and pool_recycle only apply to server databases
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': 5,
+        'max_overflow': 10,
+        'pool_timeout': 30,
+        'pool_recycle': 1800,
+        'pool_pre_ping': True,
+    }
+    #read replicas, see app/replicas.py: comma-separated URIs in DATABASE_REPLICAS.
+    #GET/HEAD requests read from them round robin; a replica that fails is
+    #skipped for REPLICA_RETRY_INTERVAL seconds; a user who just wrote reads
+    #the primary for REPLICA_STICKY_SECONDS
+    SQLALCHEMY_REPLICAS = [uri for uri in (os.environ.get('DATABASE_REPLICAS') or '').split(',') if uri]
+    REPLICA_STICKY_SECONDS = 5
+    REPLICA_RETRY_INTERVAL = 30
+    #max SQL statements per GET request, None disables the check; over it the
+    #request fails if SQL_STATEMENT_BUDGET_STRICT, else a warning is logged.
+    #SQL_STATEMENT_BUDGETS overrides it per endpoint, for any method
+    SQL_STATEMENT_BUDGET = None
+    SQL_STATEMENT_BUDGETS = {}
+    SQL_STATEMENT_BUDGET_STRICT = False
+    #per-request query profiling: Server-Timing header, log line, admin dashboard
+    SQL_PROFILER = os.environ.get('SQL_PROFILER') == '1'
+    SQL_PROFILER_HISTORY = 200
+    SQL_PROFILER_SLOWEST = 5
     
 class Development(Config):
     DEBUG = True
+    SQL_PROFILER = os.environ.get('SQL_PROFILER') != '0'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or "sqlite:///" + os.path.join(basedir, 'test.db')
     
 class Production(Config):
     DEBUG = False
     SQLALCHEMY_DATABASE_URI = os.environ.get("DATABASE_URL") or "sqlite:///" + os.path.join(basedir, 'site.db')
-    
\ No newline at end of file
+    SQLITE_PRAGMAS = {
+        **Config.SQLITE_PRAGMAS,
+        'cache_size': -64000,
+        'mmap_size': 256 * 1024 * 1024,
+    }
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        **Config.SQLALCHEMY_ENGINE_OPTIONS,
+        'pool_size': int(os.environ.get('DB_POOL_SIZE') or 10),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW') or 20),
+        'pool_timeout': 10,
+    }
+    
+
+
+class Testing(Development):
+    TESTING = True
+    JOBS_MODE = 'eager'
+    WTF_CSRF_ENABLED = False
+    SQL_STATEMENT_BUDGET = 12
+    SQL_STATEMENT_BUDGET_STRICT = True
@@ -90,9 +90,18 @@ def run_migrations_online():
                 directives[:] = []
                 logger.info('No changes in schema detected.')
 
+    # tables created by hand in migrations, not by the models: the posts_fts
+    # full-text index and the shadow tables FTS5 keeps next to it
+    def include_name(name, type_, parent_names):
+        if type_ == 'table':
+            return not name.startswith('posts_fts')
+        return True
+
     conf_args = current_app.extensions['migrate'].configure_args
     if conf_args.get("process_revision_directives") is None:
         conf_args["process_revision_directives"] = process_revision_directives
+    if conf_args.get("include_name") is None:
+        conf_args["include_name"] = include_name
 
     connectable = get_engine()
 
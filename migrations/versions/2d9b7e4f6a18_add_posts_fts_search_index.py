@@ -0,0 +1,72 @@
+"""Add posts_fts full-text index with sync triggers (SQLite only).
+
+Revision ID: 2d9b7e4f6a18
+Revises: 8f6c3b2d1e05
+Create Date: 2026-10-18 14:05:33.612978
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2d9b7e4f6a18'
+down_revision = '8f6c3b2d1e05'
+branch_labels = None
+depends_on = None
+
+
+# tag names of one post, space separated, as indexed in posts_fts.tags
+TAGS_OF = (
+    "coalesce((SELECT group_concat(t.name, ' ') FROM post_tags pt "
+    "JOIN tags t ON t.id = pt.tag_id WHERE pt.post_id = {post_id}), '')"
+)
+
+TRIGGERS = {
+    'posts_fts_ai': "AFTER INSERT ON posts BEGIN "
+                    "INSERT INTO posts_fts (rowid, title, body, tags) VALUES (new.id, new.title, new.body, ''); END",
+    'posts_fts_au': "AFTER UPDATE OF title, body ON posts BEGIN "
+                    "UPDATE posts_fts SET title = new.title, body = new.body WHERE rowid = new.id; END",
+    'posts_fts_ad': "AFTER DELETE ON posts BEGIN "
+                    "DELETE FROM posts_fts WHERE rowid = old.id; END",
+    'post_tags_fts_ai': "AFTER INSERT ON post_tags BEGIN "
+                        "UPDATE posts_fts SET tags = " + TAGS_OF.format(post_id='new.post_id') +
+                        " WHERE rowid = new.post_id; END",
+    'post_tags_fts_ad': "AFTER DELETE ON post_tags BEGIN "
+                        "UPDATE posts_fts SET tags = " + TAGS_OF.format(post_id='old.post_id') +
+                        " WHERE rowid = old.post_id; END",
+    'tags_fts_au': "AFTER UPDATE OF name ON tags BEGIN "
+                   "UPDATE posts_fts SET tags = " + TAGS_OF.format(post_id='posts_fts.rowid') +
+                   " WHERE rowid IN (SELECT post_id FROM post_tags WHERE tag_id = new.id); END",
+}
+
+
+def upgrade():
+    # other databases use the in-process index in app/search.py
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+
+    # NOTE: a batch migration that recreates posts, post_tags or tags drops
+    # these triggers; recreate them afterwards and run `flask rebuild_search_index`
+    op.execute(
+        "CREATE VIRTUAL TABLE posts_fts USING fts5("
+        "title, body, tags, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+    )
+    # title and tag matches rank above body matches
+    op.execute("INSERT INTO posts_fts (posts_fts, rank) VALUES ('rank', 'bm25(10.0, 1.0, 5.0)')")
+    for name, body in TRIGGERS.items():
+        op.execute(f'CREATE TRIGGER {name} {body}')
+
+    op.execute(
+        "INSERT INTO posts_fts (rowid, title, body, tags) "
+        "SELECT p.id, p.title, p.body, " + TAGS_OF.format(post_id='p.id') + " FROM posts p"
+    )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+
+    for name in TRIGGERS:
+        op.execute(f'DROP TRIGGER IF EXISTS {name}')
+    op.execute('DROP TABLE IF EXISTS posts_fts')
@@ -0,0 +1,26 @@
+"""Add composite (author_id, create_at) index on posts for the home feed.
+
+Revision ID: 3b8e5f1c2a47
+Revises: 07053c5bd1df
+Create Date: 2026-10-18 09:12:40.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b8e5f1c2a47'
+down_revision = '07053c5bd1df'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('posts', schema=None) as batch_op:
+        batch_op.create_index('ix_posts_author_id_create_at', ['author_id', 'create_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('posts', schema=None) as batch_op:
+        batch_op.drop_index('ix_posts_author_id_create_at')
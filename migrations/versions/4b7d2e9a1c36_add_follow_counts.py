@@ -0,0 +1,40 @@
+"""Add users.followers_count/following_count and the reverse followers index.
+
+Revision ID: 4b7d2e9a1c36
+Revises: 9c1e6b4a2d80
+Create Date: 2026-10-18 18:02:37.114508
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4b7d2e9a1c36'
+down_revision = '9c1e6b4a2d80'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('followers', schema=None) as batch_op:
+        batch_op.create_index('ix_followers_followed_id_follower_id', ['followed_id', 'follower_id'], unique=False)
+
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('followers_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('following_count', sa.Integer(), server_default='0', nullable=False))
+
+    op.execute(
+        "UPDATE users SET "
+        "followers_count = (SELECT count(*) FROM followers f WHERE f.followed_id = users.id), "
+        "following_count = (SELECT count(*) FROM followers f WHERE f.follower_id = users.id)"
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_column('following_count')
+        batch_op.drop_column('followers_count')
+
+    with op.batch_alter_table('followers', schema=None) as batch_op:
+        batch_op.drop_index('ix_followers_followed_id_follower_id')
@@ -0,0 +1,35 @@
+"""Add stored excerpt column to posts.
+
+Revision ID: 5e2a0c8d7f19
+Revises: c41d7a9e0b63
+Create Date: 2026-10-18 11:20:05.904417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e2a0c8d7f19'
+down_revision = 'c41d7a9e0b63'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('posts', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('excerpt', sa.String(length=153), nullable=True))
+
+    # same rule as models.make_excerpt
+    op.execute(
+        "UPDATE posts SET excerpt = CASE WHEN length(body) > 150 "
+        "THEN substr(body, 1, 150) || '...' ELSE body END"
+    )
+
+    with op.batch_alter_table('posts', schema=None) as batch_op:
+        batch_op.alter_column('excerpt', existing_type=sa.String(length=153), nullable=False)
+
+
+def downgrade():
+    with op.batch_alter_table('posts', schema=None) as batch_op:
+        batch_op.drop_column('excerpt')
@@ -0,0 +1,37 @@
+"""Add users.email_hash for avatar URLs.
+
+Revision ID: 7f3c9a2e5d41
+Revises: e3a8c1f5b924
+Create Date: 2026-10-18 20:31:48.562017
+
+"""
+from hashlib import md5
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7f3c9a2e5d41'
+down_revision = 'e3a8c1f5b924'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('email_hash', sa.String(length=32), nullable=True))
+
+    #md5 isn't available in SQLite, hash in Python (same rule as app.avatars.email_hash)
+    conn = op.get_bind()
+    users = sa.table('users', sa.column('id', sa.Integer), sa.column('email', sa.String), sa.column('email_hash', sa.String))
+    rows = conn.execute(sa.select(users.c.id, users.c.email).where(users.c.email.is_not(None))).all()
+    if rows:
+        conn.execute(
+            users.update().where(users.c.id == sa.bindparam('b_id')).values(email_hash=sa.bindparam('b_hash')),
+            [{'b_id': id, 'b_hash': md5(email.strip().lower().encode('utf-8')).hexdigest()} for id, email in rows]
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_column('email_hash')
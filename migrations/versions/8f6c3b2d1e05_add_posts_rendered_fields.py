@@ -0,0 +1,31 @@
+"""Add body_html, word_count and reading_time to posts.
+
+Revision ID: 8f6c3b2d1e05
+Revises: 5e2a0c8d7f19
+Create Date: 2026-10-18 12:41:52.377091
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8f6c3b2d1e05'
+down_revision = '5e2a0c8d7f19'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # body_html is filled by `flask backfill_post_fields`
+    with op.batch_alter_table('posts', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('body_html', sa.Text(), nullable=True))
+        batch_op.add_column(sa.Column('word_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('reading_time', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('posts', schema=None) as batch_op:
+        batch_op.drop_column('reading_time')
+        batch_op.drop_column('word_count')
+        batch_op.drop_column('body_html')
@@ -0,0 +1,39 @@
+"""Add notification inbox indexes and users.unread_notifications.
+
+Revision ID: 9c1e6b4a2d80
+Revises: 6a4f9d0c3b72
+Create Date: 2026-10-18 16:48:21.740295
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c1e6b4a2d80'
+down_revision = '6a4f9d0c3b72'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('notifications', schema=None) as batch_op:
+        batch_op.create_index('ix_notifications_user_id_timestamp', ['user_id', 'timestamp'], unique=False)
+        batch_op.create_index('ix_notifications_user_id_is_read_timestamp', ['user_id', 'is_read', 'timestamp'], unique=False)
+
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('unread_notifications', sa.Integer(), server_default='0', nullable=False))
+
+    op.execute(
+        "UPDATE users SET unread_notifications = ("
+        "SELECT count(*) FROM notifications n WHERE n.user_id = users.id AND n.is_read = 0)"
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_column('unread_notifications')
+
+    with op.batch_alter_table('notifications', schema=None) as batch_op:
+        batch_op.drop_index('ix_notifications_user_id_is_read_timestamp')
+        batch_op.drop_index('ix_notifications_user_id_timestamp')
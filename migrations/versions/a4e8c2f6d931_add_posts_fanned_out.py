@@ -0,0 +1,34 @@
+"""Add posts.fanned_out for the hybrid home feed.
+
+Revision ID: a4e8c2f6d931
+Revises: f3c9d5a7b146
+Create Date: 2026-10-18 21:24:09.518230
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4e8c2f6d931'
+down_revision = 'f3c9d5a7b146'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # every existing post counts as fanned out; hybrid mode is switched on
+    # with `flask backfill_timeline`, which re-decides each post by its
+    # author's follower count at that point
+    with op.batch_alter_table('posts', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('fanned_out', sa.Boolean(), server_default='1', nullable=False))
+
+    with op.batch_alter_table('posts', schema=None) as batch_op:
+        batch_op.create_index('ix_posts_fan_in_author_id_create_at', ['author_id', 'create_at'], unique=False,
+                              sqlite_where=sa.text('fanned_out = 0'), postgresql_where=sa.text('NOT fanned_out'))
+
+
+def downgrade():
+    # plain ALTER TABLE: a batch copy of posts would drop the posts_fts triggers
+    op.drop_index('ix_posts_fan_in_author_id_create_at', table_name='posts')
+    op.drop_column('posts', 'fanned_out')
@@ -0,0 +1,44 @@
+"""Add slug_counters and slug_history.
+
+Revision ID: b5d1f7c3e8a2
+Revises: 7f3c9a2e5d41
+Create Date: 2026-10-18 22:12:05.318406
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5d1f7c3e8a2'
+down_revision = '7f3c9a2e5d41'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('slug_counters',
+    sa.Column('base', sa.String(length=255), nullable=False),
+    sa.Column('last', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('base')
+    )
+    op.create_table('slug_history',
+    sa.Column('slug', sa.String(length=255), nullable=False),
+    sa.Column('post_id', sa.Integer(), nullable=False),
+    sa.Column('create_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['post_id'], ['posts.id'], ),
+    sa.PrimaryKeyConstraint('slug')
+    )
+    with op.batch_alter_table('slug_history', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_slug_history_post_id'), ['post_id'], unique=False)
+
+    # existing slugs are taken: the allocator must never hand them out again
+    op.execute("INSERT INTO slug_counters (base, last) SELECT slug, 1 FROM posts")
+
+
+def downgrade():
+    with op.batch_alter_table('slug_history', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_slug_history_post_id'))
+
+    op.drop_table('slug_history')
+    op.drop_table('slug_counters')
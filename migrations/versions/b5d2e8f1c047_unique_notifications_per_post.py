@@ -0,0 +1,37 @@
+"""Make notifications unique per (user_id, post_id).
+
+Revision ID: b5d2e8f1c047
+Revises: f8e2b4d6a913
+Create Date: 2026-10-18 19:12:40.318522
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5d2e8f1c047'
+down_revision = 'f8e2b4d6a913'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    #retried fan-out jobs may already have sent some followers a post twice:
+    #keep the first notification and recount the unread badges
+    op.execute(
+        "DELETE FROM notifications WHERE post_id IS NOT NULL AND id NOT IN ("
+        "SELECT min(id) FROM notifications WHERE post_id IS NOT NULL GROUP BY user_id, post_id)"
+    )
+    op.execute(
+        "UPDATE users SET unread_notifications = ("
+        "SELECT count(*) FROM notifications n WHERE n.user_id = users.id AND n.is_read = 0)"
+    )
+
+    with op.batch_alter_table('notifications', schema=None) as batch_op:
+        batch_op.create_index('ix_notifications_user_id_post_id', ['user_id', 'post_id'], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('notifications', schema=None) as batch_op:
+        batch_op.drop_index('ix_notifications_user_id_post_id')
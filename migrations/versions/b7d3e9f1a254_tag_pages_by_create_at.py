@@ -0,0 +1,36 @@
+"""Page tags by (create_at, id) and suggest them case-insensitively.
+
+Revision ID: b7d3e9f1a254
+Revises: a4e8c2f6d931
+Create Date: 2026-10-18 23:02:41.177305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d3e9f1a254'
+down_revision = 'a4e8c2f6d931'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # plain ALTER TABLE: a batch copy of post_tags or tags would drop their
+    # fts triggers
+    op.add_column('post_tags', sa.Column('create_at', sa.DateTime(), nullable=True))
+    op.execute(
+        "UPDATE post_tags SET create_at = "
+        "(SELECT posts.create_at FROM posts WHERE posts.id = post_tags.post_id)"
+    )
+    op.create_index('ix_post_tags_tag_id_create_at', 'post_tags', ['tag_id', 'create_at', 'post_id'], unique=False)
+    op.drop_index('ix_post_tags_tag_id_post_id', table_name='post_tags')
+    op.create_index('ix_tags_name_lower', 'tags', [sa.text('lower(name)')], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_tags_name_lower', table_name='tags')
+    op.create_index('ix_post_tags_tag_id_post_id', 'post_tags', ['tag_id', 'post_id'], unique=False)
+    op.drop_index('ix_post_tags_tag_id_create_at', table_name='post_tags')
+    op.drop_column('post_tags', 'create_at')
@@ -0,0 +1,36 @@
+"""Add timeline_entries table for the fan-out-on-write home feed.
+
+Revision ID: c41d7a9e0b63
+Revises: 3b8e5f1c2a47
+Create Date: 2026-10-18 10:03:27.540113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41d7a9e0b63'
+down_revision = '3b8e5f1c2a47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('timeline_entries',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('post_id', sa.Integer(), nullable=False),
+    sa.Column('create_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['post_id'], ['posts.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'post_id')
+    )
+    with op.batch_alter_table('timeline_entries', schema=None) as batch_op:
+        batch_op.create_index('ix_timeline_entries_user_id_create_at', ['user_id', 'create_at', 'post_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('timeline_entries', schema=None) as batch_op:
+        batch_op.drop_index('ix_timeline_entries_user_id_create_at')
+
+    op.drop_table('timeline_entries')
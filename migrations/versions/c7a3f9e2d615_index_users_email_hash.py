@@ -0,0 +1,26 @@
+"""Index users.email_hash for the local avatar route.
+
+Revision ID: c7a3f9e2d615
+Revises: b5d2e8f1c047
+Create Date: 2026-10-18 19:40:05.902114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7a3f9e2d615'
+down_revision = 'b5d2e8f1c047'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_users_email_hash'), ['email_hash'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_users_email_hash'))
@@ -0,0 +1,31 @@
+"""Add stat_counters for the notification fan-out totals.
+
+Revision ID: c9e4a2f7d318
+Revises: b7d3e9f1a254
+Create Date: 2026-10-18 23:41:06.502918
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c9e4a2f7d318'
+down_revision = 'b7d3e9f1a254'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    stat_counters = op.create_table('stat_counters',
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('value', sa.Float(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    # moved by every notify_followers job, see app/notifications.py
+    op.bulk_insert(stat_counters, [{'name': f'fan_out.{name}', 'value': 0}
+                                   for name in ('jobs', 'notifications', 'batches', 'seconds')])
+
+
+def downgrade():
+    op.drop_table('stat_counters')
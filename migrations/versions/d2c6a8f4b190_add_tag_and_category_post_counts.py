@@ -0,0 +1,47 @@
+"""Add post_count to tags and categories, tag page and category page indexes.
+
+Revision ID: d2c6a8f4b190
+Revises: b5d1f7c3e8a2
+Create Date: 2026-10-18 23:40:17.904215
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2c6a8f4b190'
+down_revision = 'b5d1f7c3e8a2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('post_tags', schema=None) as batch_op:
+        batch_op.create_index('ix_post_tags_tag_id_post_id', ['tag_id', 'post_id'], unique=False)
+
+    with op.batch_alter_table('posts', schema=None) as batch_op:
+        batch_op.create_index('ix_posts_category_id_create_at', ['category_id', 'create_at'], unique=False)
+
+    with op.batch_alter_table('tags', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('post_count', sa.Integer(), server_default='0', nullable=False))
+
+    with op.batch_alter_table('categories', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('post_count', sa.Integer(), server_default='0', nullable=False))
+
+    op.execute("UPDATE tags SET post_count = (SELECT count(*) FROM post_tags pt WHERE pt.tag_id = tags.id)")
+    op.execute("UPDATE categories SET post_count = (SELECT count(*) FROM posts p WHERE p.category_id = categories.id)")
+
+
+def downgrade():
+    with op.batch_alter_table('categories', schema=None) as batch_op:
+        batch_op.drop_column('post_count')
+
+    with op.batch_alter_table('tags', schema=None) as batch_op:
+        batch_op.drop_column('post_count')
+
+    with op.batch_alter_table('posts', schema=None) as batch_op:
+        batch_op.drop_index('ix_posts_category_id_create_at')
+
+    with op.batch_alter_table('post_tags', schema=None) as batch_op:
+        batch_op.drop_index('ix_post_tags_tag_id_post_id')
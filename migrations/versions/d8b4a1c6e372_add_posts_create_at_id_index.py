@@ -0,0 +1,26 @@
+"""Add a (create_at, id) index on posts for the archive keyset pages.
+
+Revision ID: d8b4a1c6e372
+Revises: c7a3f9e2d615
+Create Date: 2026-10-18 20:02:51.446870
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd8b4a1c6e372'
+down_revision = 'c7a3f9e2d615'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('posts', schema=None) as batch_op:
+        batch_op.create_index('ix_posts_create_at_id', ['create_at', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('posts', schema=None) as batch_op:
+        batch_op.drop_index('ix_posts_create_at_id')
@@ -0,0 +1,26 @@
+"""Add an index on posts.update_at for conditional GETs on the archive.
+
+Revision ID: e3a8c1f5b924
+Revises: 4b7d2e9a1c36
+Create Date: 2026-10-18 19:14:05.381920
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3a8c1f5b924'
+down_revision = '4b7d2e9a1c36'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('posts', schema=None) as batch_op:
+        batch_op.create_index('ix_posts_update_at', ['update_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('posts', schema=None) as batch_op:
+        batch_op.drop_index('ix_posts_update_at')
@@ -0,0 +1,32 @@
+"""Add the 'posts' cache generation and drop the posts.update_at index.
+
+Revision ID: e6f1b7d3a528
+Revises: d8b4a1c6e372
+Create Date: 2026-10-18 20:31:17.205736
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e6f1b7d3a528'
+down_revision = 'd8b4a1c6e372'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # bumped with every post written, see app/generations.py; it replaces
+    # max(update_at) as the archive's validator
+    op.execute("INSERT INTO cache_generations (name, generation) VALUES ('posts', 0)")
+
+    with op.batch_alter_table('posts', schema=None) as batch_op:
+        batch_op.drop_index('ix_posts_update_at')
+
+
+def downgrade():
+    with op.batch_alter_table('posts', schema=None) as batch_op:
+        batch_op.create_index('ix_posts_update_at', ['update_at'], unique=False)
+
+    op.execute("DELETE FROM cache_generations WHERE name = 'posts'")
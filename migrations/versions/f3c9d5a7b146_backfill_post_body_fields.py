@@ -0,0 +1,68 @@
+"""Backfill word_count and reading_time on existing posts.
+
+body_html is rendered by `flask backfill_post_fields`, not here: the
+renderer is app code and changes with it. Until then read_post renders
+those posts through the markdown cache.
+
+Revision ID: f3c9d5a7b146
+Revises: e6f1b7d3a528
+Create Date: 2026-10-18 20:58:36.614093
+
+"""
+import logging
+import math
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3c9d5a7b146'
+down_revision = 'e6f1b7d3a528'
+branch_labels = None
+depends_on = None
+
+# as in app/models.py when this migration was written
+WORDS_PER_MINUTE = 200
+CHUNK_SIZE = 500
+
+
+def upgrade():
+    # posts from before 8f6c3b2d1e05 came up with word_count = reading_time = 0;
+    # same values as Post.refresh_body_fields(), keyed on id and without
+    # touching update_at
+    conn = op.get_bind()
+    posts = sa.table('posts', sa.column('id', sa.Integer), sa.column('body', sa.Text),
+                     sa.column('body_html', sa.Text), sa.column('word_count', sa.Integer),
+                     sa.column('reading_time', sa.Integer))
+    update = (
+        sa.update(posts)
+        .where(posts.c.id == sa.bindparam('b_id'))
+        .values(word_count=sa.bindparam('b_word_count'),
+                reading_time=sa.bindparam('b_reading_time'))
+    )
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            sa.select(posts.c.id, posts.c.body)
+            .where(sa.or_(posts.c.reading_time.is_(None), posts.c.reading_time == 0), posts.c.id > last_id)
+            .order_by(posts.c.id).limit(CHUNK_SIZE)
+        ).all()
+        if not rows:
+            break
+        params = []
+        for id, body in rows:
+            word_count = len((body or '').split())
+            params.append({'b_id': id, 'b_word_count': word_count,
+                           'b_reading_time': max(1, math.ceil(word_count / WORDS_PER_MINUTE))})
+        conn.execute(update, params)
+        last_id = rows[-1].id
+
+    missing = conn.scalar(sa.select(sa.func.count()).select_from(posts).where(posts.c.body_html.is_(None)))
+    if missing:
+        logging.getLogger('alembic.runtime.migration').warning(
+            '%d posts have no body_html yet, run `flask backfill_post_fields` to store it', missing)
+
+
+def downgrade():
+    # the values are what the app would compute anyway
+    pass
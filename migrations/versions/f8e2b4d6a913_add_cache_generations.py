@@ -0,0 +1,30 @@
+"""Add cache_generations for the reference-data cache.
+
+Revision ID: f8e2b4d6a913
+Revises: d2c6a8f4b190
+Create Date: 2026-10-19 00:52:41.127630
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f8e2b4d6a913'
+down_revision = 'd2c6a8f4b190'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    cache_generations = op.create_table('cache_generations',
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('generation', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    # bumped with every change to categories and roles, see app/reference.py
+    op.bulk_insert(cache_generations, [{'name': 'reference', 'generation': 0}])
+
+
+def downgrade():
+    op.drop_table('cache_generations')
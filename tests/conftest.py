@@ -0,0 +1,70 @@
+import os
+import tempfile
+
+#the app reads its config when it's imported, so the environment comes first
+_tmpdir = tempfile.mkdtemp(prefix='blog-tests-')
+os.environ['APP_CONFIG'] = 'Testing'
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_tmpdir, 'test.db')
+os.environ['AVATAR_CACHE_DIR'] = os.path.join(_tmpdir, 'avatars')
+
+import pytest
+from flask_migrate import upgrade
+from app import app as flask_app, db
+from app.models import User, Role, Category
+
+
+PASSWORD = 'pw'
+
+
+@pytest.fixture(scope='session')
+def app():
+    with flask_app.app_context():
+        #the migrations, not create_all: the FTS triggers and seed rows live there
+        upgrade()
+        for name in ('Admin', 'Editor', 'Author', 'Viewer'):
+            db.session.add(Role(name=name, description=f'{name} role'))
+        db.session.commit()
+    yield flask_app
+
+
+@pytest.fixture(scope='session')
+def seeded(app):
+    #alice, bob and carol; bob and carol follow alice, who has written 30
+    #tagged posts (so bob and carol have a notification for each)
+    with app.app_context():
+        users = []
+        for name in ('alice', 'bob', 'carol'):
+            user = User(username=name, email=f'{name}@example.com')
+            user.set_password(PASSWORD)
+            db.session.add(user)
+            users.append(user)
+        db.session.add(Category(name='General', description='General posts'))
+        db.session.commit()
+        users[0].roles.append(db.session.scalar(db.select(Role).filter_by(name='Admin')))
+        users[1].follow(users[0])
+        users[2].follow(users[0])
+        db.session.commit()
+
+    client = app.test_client()
+    log_in(client, 'alice')
+    for i in range(30):
+        response = client.post('/post/new', data={'title': f'Post {i}', 'body': 'hello world ' * (i + 5),
+                                                  'category_id': 1, 'tags': '#flask #python'})
+        assert response.status_code == 302
+    return app
+
+
+def log_in(client, username):
+    response = client.post('/login', data={'username': username, 'password': PASSWORD})
+    assert response.status_code == 302
+    return client
+
+
+@pytest.fixture
+def login():
+    return log_in
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
@@ -0,0 +1,58 @@
+import argparse
+import copy
+import json
+import os
+import subprocess
+import sys
+import pytest
+
+BENCHMARKS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks')
+sys.path.insert(0, BENCHMARKS)
+import bench
+
+
+@pytest.fixture(scope='module')
+def report(tmp_path_factory):
+    #a real run in its own process: bench.run() configures the app on import,
+    #and it gets a fresh temp database built by datagen.generate()
+    output = tmp_path_factory.mktemp('bench') / 'report.json'
+    env = {key: value for key, value in os.environ.items() if key not in ('APP_CONFIG', 'DATABASE_URL')}
+    subprocess.run([sys.executable, os.path.join(BENCHMARKS, 'bench.py'), 'run',
+                    '--users', '20', '--posts', '50', '--notifications', '200',
+                    '--requests', '2', '--warmup', '1', '--scenario', 'home', '--output', str(output)],
+                   env=env, check=True, capture_output=True)
+    with open(output) as f:
+        return json.load(f)
+
+
+def test_run_builds_data_and_times_a_scenario(report):
+    assert report['meta']['dataset']['notifications'] == 200
+    assert list(report['test_client']) == ['home']
+    home = report['test_client']['home']
+    assert home['requests'] == 2 and home['errors'] == 0
+    assert home['queries_per_request'] > 0
+
+
+def write(path, report):
+    path.write_text(json.dumps(report))
+    return str(path)
+
+
+def compare(tmp_path, baseline, current):
+    return bench.compare(argparse.Namespace(baseline=write(tmp_path / 'baseline.json', baseline),
+                                            current=write(tmp_path / 'current.json', current),
+                                            metric='p95_ms', threshold=0.1))
+
+
+def test_compare_passes_an_unchanged_run(tmp_path, report):
+    assert compare(tmp_path, report, report) == 0
+
+
+def test_compare_flags_slowdowns_and_extra_queries(tmp_path, report):
+    slower = copy.deepcopy(report)
+    slower['test_client']['home']['p95_ms'] = report['test_client']['home']['p95_ms'] * 2 + 1
+    assert compare(tmp_path, report, slower) == 1
+
+    chattier = copy.deepcopy(report)
+    chattier['test_client']['home']['queries_per_request'] += 1
+    assert compare(tmp_path, report, chattier) == 1
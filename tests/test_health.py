@@ -0,0 +1,20 @@
+def test_public_health_is_status_and_pool_counters(seeded, client):
+    response = client.get('/health')
+    assert response.status_code == 200
+    report = response.get_json()
+    assert set(report) == {'status', 'pool'}
+    assert report['status'] == 'ok'
+    assert 'pool' not in report['pool'] and report['pool']['checkouts'] > 0
+
+
+def test_non_admins_get_the_public_report(seeded, client, login):
+    login(client, 'bob')
+    assert set(client.get('/health').get_json()) == {'status', 'pool'}
+
+
+def test_admins_get_the_full_report(seeded, client, login):
+    login(client, 'alice')
+    report = client.get('/health').get_json()
+    assert report['database']['dialect'] == 'sqlite'
+    assert report['database']['settings']['journal_mode'] == 'wal'
+    assert report['replicas'] == []
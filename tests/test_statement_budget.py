@@ -0,0 +1,22 @@
+import pytest
+
+
+@pytest.mark.parametrize('path', ['/home', '/posts', '/post/post-3', '/profile/alice', '/profile/bob'])
+def test_pages_stay_under_budget(seeded, client, login, path):
+    #the profiler raises in after_request when a page goes over budget
+    login(client, 'bob')
+    assert client.get(path).status_code == 200
+
+
+def test_over_budget_page_fails(seeded, client, login, monkeypatch):
+    login(client, 'bob')
+    monkeypatch.setitem(seeded.config, 'SQL_STATEMENT_BUDGET', 0)
+    with pytest.raises(AssertionError, match='budget is 0'):
+        client.get('/home')
+
+
+def test_writes_are_not_checked(seeded, client, login, monkeypatch):
+    login(client, 'alice')
+    monkeypatch.setitem(seeded.config, 'SQL_STATEMENT_BUDGET', 0)
+    response = client.post('/post/new', data={'title': 'Budget', 'body': 'x', 'category_id': 1, 'tags': ''})
+    assert response.status_code == 302